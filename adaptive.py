@@ -0,0 +1,93 @@
+"""
+Adaptive tracker polling.
+
+Picks the next poll interval from the observed bid totals: poll at the floor rate
+while the race is close or the margin is closing fast, ease off towards the
+ceiling rate as one side builds a commanding lead, and back off exponentially
+(with jitter) while the tracker is erroring.
+"""
+import random
+import time
+
+
+class AdaptivePollInterval:
+    def __init__(
+        self,
+        min_interval_seconds: float,
+        max_interval_seconds: float,
+        close_margin: float,
+        comfortable_margin: float,
+        max_error_backoff_seconds: float,
+        jitter: float = 0.2,
+    ):
+        self._min_interval = min_interval_seconds
+        self._max_interval = max_interval_seconds
+        self._close_margin = close_margin
+        self._comfortable_margin = comfortable_margin
+        self._max_error_backoff = max_error_backoff_seconds
+        self._jitter = jitter
+        self._margin: float = None
+        self._margin_at: float = None
+        self._closing_rate: float = 0.0
+        self._lead_change_in: float = None
+        self.consecutive_errors: int = 0
+
+    @staticmethod
+    def margin(totals) -> float:
+        """The gap between the leader and the runner up."""
+        leader, runner_up = 0.0, 0.0
+        for total in totals:
+            if total > leader:
+                leader, runner_up = total, leader
+            elif total > runner_up:
+                runner_up = total
+        return leader - runner_up
+
+    def observe(self, totals, now: float = None, lead_change_in: float = None):
+        """
+        Record a successful poll's bid totals. lead_change_in is the projected number
+        of seconds until the lead changes hands (see history.BidHistories), if known.
+        """
+        now = time.monotonic() if now is None else now
+        margin = self.margin(totals)
+        if self._margin is not None and now > self._margin_at:
+            # How fast the lead is shrinking, in dollars per second (0 if it's growing)
+            self._closing_rate = max(
+                (self._margin - margin) / (now - self._margin_at), 0.0
+            )
+        self._margin, self._margin_at = margin, now
+        self._lead_change_in = lead_change_in
+        self.consecutive_errors = 0
+
+    def error(self):
+        """Record a failed poll."""
+        self.consecutive_errors += 1
+
+    def next_interval(self) -> float:
+        if self.consecutive_errors:
+            backoff = min(
+                self._min_interval * 2**self.consecutive_errors,
+                self._max_error_backoff,
+            )
+            return backoff * (1 + random.uniform(0, self._jitter))
+        if self._margin is None:
+            return self._min_interval
+
+        if self._margin <= self._close_margin:
+            interval = self._min_interval
+        elif self._margin >= self._comfortable_margin:
+            interval = self._max_interval
+        else:
+            position = (self._margin - self._close_margin) / (
+                self._comfortable_margin - self._close_margin
+            )
+            interval = self._min_interval + position * (
+                self._max_interval - self._min_interval
+            )
+        if self._lead_change_in is not None:
+            # Poll a few times before the lead is projected to change hands
+            interval = min(interval, self._lead_change_in / 4)
+        elif self._closing_rate > 0:
+            # Poll a few times before the lead could change hands at the current rate
+            interval = min(interval, self._margin / self._closing_rate / 4)
+        return max(self._min_interval, min(interval, self._max_interval))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Long-lived aninja worker for the TASBot eye driver.
+
+Started once by eyes.EyeDriver as `aninja_worker.py <aninja> [frame function]`.
+Each line on stdin is one of:
+
+    <image path>
+        run aninja to draw the image file
+    frames<TAB><digest><TAB><frames path><TAB><width><TAB><height>
+        push pre-rendered raw frames (see frames.py) with aninja's frame function
+
+and each is answered with a single "ok" or "error <reason>" line on stdout. aninja
+runs inside this already-warm interpreter, so its imports are only paid for once
+instead of on every eye change, and pre-rendered frames are kept in memory by
+digest after their first use.
+"""
+import os
+import runpy
+import sys
+
+
+def load_frames(path: str, width: int, height: int) -> list[memoryview]:
+    with open(path, "rb") as f:
+        raw = memoryview(f.read())
+    frame_size = width * height * 3
+    return [raw[i : i + frame_size] for i in range(0, len(raw), frame_size)]
+
+
+def main():
+    aninja = sys.argv[1]
+    draw_frames = None
+    if len(sys.argv) > 2:
+        draw_frames = runpy.run_path(aninja, run_name="aninja")[sys.argv[2]]
+    frames_by_digest: dict[str, list[memoryview]] = {}
+
+    # Keep the real stdout for replies, and send anything aninja prints to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        try:
+            if line.startswith("frames\t"):
+                _, digest, path, width, height = line.split("\t")
+                if digest not in frames_by_digest:
+                    frames_by_digest[digest] = load_frames(
+                        path, int(width), int(height)
+                    )
+                draw_frames(frames_by_digest[digest], int(width), int(height))
+            else:
+                sys.argv = [aninja, line]
+                runpy.run_path(aninja, run_name="__main__")
+            reply = "ok"
+        except SystemExit as e:
+            reply = "ok" if e.code in (None, 0) else f"error exit status {e.code}"
+        except Exception as e:
+            reply = f"error {e!r}"
+        replies.write(reply.replace("\n", " ") + "\n")
+
+
+if __name__ == "__main__":
+    main()
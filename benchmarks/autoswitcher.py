@@ -0,0 +1,34 @@
+"""
+Runs the autoswitcher with configuration overrides, for the benchmarks.
+
+    python -m benchmarks.autoswitcher '<JSON overrides>'
+
+The overrides are merged into config.CONFIG before main is imported, so they
+apply everywhere main reads its configuration. obs.targets is replaced rather
+than merged, so the benchmark only ever drives its own stand-in.
+"""
+import json
+import sys
+
+from config import CONFIG
+
+
+def merge(config: dict, overrides: dict):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge(config[key], value)
+        else:
+            config[key] = value
+
+
+if __name__ == "__main__":
+    overrides: dict = json.loads(sys.argv[1])
+    targets = overrides.get("obs", {}).pop("targets", None)
+    merge(CONFIG, overrides)
+    if targets is not None:
+        CONFIG["obs"]["targets"] = targets
+    sys.argv = sys.argv[:1]
+
+    import main
+
+    main.main()
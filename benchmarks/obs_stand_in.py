@@ -0,0 +1,223 @@
+"""
+A local stand-in for OBS that speaks the obs-websocket v5 protocol (msgpack).
+
+Answers Identify, Request and RequestBatch messages from one scene whose items
+can be reordered, plus input mutes (see recording.StandInObs). It also sends the
+SceneItemListReindexed and InputMuteStateChanged events a real OBS would. Every
+request is recorded with the time it was applied, and each message can be
+delayed to simulate the round trip to a remote OBS.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import secrets
+import time
+
+import msgpack
+import simpleobsws
+from websockets.server import WebSocketServerProtocol, serve
+
+from recording import StandInObs
+
+EVENT_SUBSCRIPTION_INPUTS = 1 << 3
+EVENT_SUBSCRIPTION_SCENE_ITEMS = 1 << 7
+
+
+class ObsWebSocketStandIn:
+    def __init__(
+        self,
+        scene_name: str,
+        source_names: list[str],
+        password: str = None,
+        rtt_seconds: float = 0.0,
+        logger=logging.getLogger(),
+    ):
+        """source_names are the scene's items, bottom to top."""
+        self.obs = StandInObs(scene_name, source_names, logger)
+        self._scene_name = scene_name
+        self._password = password
+        self._rtt_seconds = rtt_seconds
+        self._logger = logger
+        self._server = None
+        self._changed = asyncio.Condition()
+        self.identified = asyncio.Event()
+        self.requests: list[tuple[float, str]] = []
+        self.changed_at: float = None
+
+    async def start(self, host: str, port: int):
+        self._server = await serve(
+            self._handler,
+            host,
+            port,
+            subprotocols=["obswebsocket.msgpack"],
+            max_size=2**24,
+        )
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def wait_for(self, predicate, timeout: float) -> float:
+        """
+        Wait until predicate(StandInObs) is true, and return the monotonic time
+        of the request that made it so.
+        """
+        async with self._changed:
+            await asyncio.wait_for(
+                self._changed.wait_for(lambda: predicate(self.obs)), timeout
+            )
+            return self.changed_at
+
+    async def _handler(self, connection: WebSocketServerProtocol):
+        salt, challenge = secrets.token_urlsafe(32), secrets.token_urlsafe(32)
+        hello = {"obsWebSocketVersion": "5.0.0", "rpcVersion": 1}
+        if self._password:
+            hello["authentication"] = {"challenge": challenge, "salt": salt}
+        await self._send(connection, 0, hello)
+        event_subscriptions = 0
+        identified = False
+        async for message in connection:
+            payload = msgpack.unpackb(message)
+            op_code, data = payload["op"], payload["d"]
+            if op_code in (1, 3):
+                if op_code == 1 and not self._authenticated(data, salt, challenge):
+                    await connection.close(4009, "Authentication failed.")
+                    return
+                event_subscriptions = data.get("eventSubscriptions", 1023)
+                identified = True
+                await self._send(connection, 2, {"negotiatedRpcVersion": 1})
+                self.identified.set()
+            elif not identified:
+                await connection.close(4007, "Not identified.")
+                return
+            elif op_code == 6:
+                asyncio.create_task(
+                    self._respond(connection, data, event_subscriptions)
+                )
+            elif op_code == 8:
+                asyncio.create_task(
+                    self._respond_batch(connection, data, event_subscriptions)
+                )
+
+    def _authenticated(self, data: dict, salt: str, challenge: str) -> bool:
+        if not self._password:
+            return True
+        secret = base64.b64encode(
+            hashlib.sha256((self._password + salt).encode()).digest()
+        )
+        expected = base64.b64encode(
+            hashlib.sha256(secret + challenge.encode()).digest()
+        ).decode()
+        return data.get("authentication") == expected
+
+    async def _send(
+        self, connection: WebSocketServerProtocol, op_code: int, data: dict
+    ):
+        await connection.send(msgpack.packb({"op": op_code, "d": data}))
+
+    async def _apply(
+        self,
+        connection: WebSocketServerProtocol,
+        request: dict,
+        event_subscriptions: int,
+    ) -> dict:
+        response: simpleobsws.RequestResponse = self.obs.handle(
+            simpleobsws.Request(request["requestType"], request.get("requestData"))
+        )
+        applied_at = time.monotonic()
+        self.requests.append((applied_at, request["requestType"]))
+        result = {
+            "requestType": response.requestType,
+            "requestStatus": {
+                "result": response.requestStatus.result,
+                "code": response.requestStatus.code,
+            },
+        }
+        if response.requestStatus.comment:
+            result["requestStatus"]["comment"] = response.requestStatus.comment
+        if response.responseData is not None:
+            result["responseData"] = response.responseData
+        if "requestId" in request:
+            result["requestId"] = request["requestId"]
+        if not response.ok():
+            return result
+
+        if request["requestType"] == "SetSceneItemIndex":
+            await self._event(
+                connection,
+                event_subscriptions,
+                EVENT_SUBSCRIPTION_SCENE_ITEMS,
+                "SceneItemListReindexed",
+                {
+                    "sceneName": self._scene_name,
+                    "sceneItems": [
+                        {
+                            "sceneItemId": item["sceneItemId"],
+                            "sceneItemIndex": item["sceneItemIndex"],
+                        }
+                        for item in self.obs.scene_items
+                    ],
+                },
+            )
+        elif request["requestType"] == "SetInputMute":
+            await self._event(
+                connection,
+                event_subscriptions,
+                EVENT_SUBSCRIPTION_INPUTS,
+                "InputMuteStateChanged",
+                {
+                    "inputName": request["requestData"]["inputName"],
+                    "inputMuted": request["requestData"]["inputMuted"],
+                },
+            )
+        else:
+            return result
+        async with self._changed:
+            self.changed_at = applied_at
+            self._changed.notify_all()
+        return result
+
+    async def _event(
+        self,
+        connection: WebSocketServerProtocol,
+        event_subscriptions: int,
+        intent: int,
+        event_type: str,
+        event_data: dict,
+    ):
+        if event_subscriptions & intent:
+            await self._send(
+                connection,
+                5,
+                {
+                    "eventType": event_type,
+                    "eventIntent": intent,
+                    "eventData": event_data,
+                },
+            )
+
+    async def _respond(
+        self, connection: WebSocketServerProtocol, data: dict, event_subscriptions: int
+    ):
+        await asyncio.sleep(self._rtt_seconds / 2)
+        result = await self._apply(connection, data, event_subscriptions)
+        await asyncio.sleep(self._rtt_seconds / 2)
+        await self._send(connection, 7, result)
+
+    async def _respond_batch(
+        self, connection: WebSocketServerProtocol, data: dict, event_subscriptions: int
+    ):
+        await asyncio.sleep(self._rtt_seconds / 2)
+        results: list[dict] = []
+        for request in data["requests"]:
+            result = await self._apply(connection, request, event_subscriptions)
+            results.append(result)
+            if data.get("haltOnFailure") and not result["requestStatus"]["result"]:
+                break
+        await asyncio.sleep(self._rtt_seconds / 2)
+        await self._send(
+            connection, 9, {"requestId": data["requestId"], "results": results}
+        )
@@ -0,0 +1,402 @@
+"""
+Lead change latency benchmark.
+
+Starts the mock tracker, a counting proxy in front of it, a local obs-websocket
+stand-in and the autoswitcher itself, then scripts lead changes through the mock
+tracker and measures how long each takes to reach OBS: from the tracker
+accepting the donation to the SetSceneItemIndex/SetInputMute requests that put
+the new leader on air being applied. Results are written as JSON.
+
+    python -m benchmarks.run --lead-changes 20 --rtt-ms 20 --output results.json
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import math
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.obs_stand_in import ObsWebSocketStandIn
+from config import CONFIG
+from recording import StandInObs
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+MOCK_TRACKER_DIR = REPO_ROOT / "mock_tracker"
+MOCK_TRACKER_URL = "http://127.0.0.1:5000"
+PROXIED_HEADERS = (
+    "Content-Type",
+    "Cache-Control",
+    "ETag",
+    "Last-Modified",
+    "If-None-Match",
+    "If-Modified-Since",
+    "Accept",
+)
+
+logger = logging.getLogger("benchmark")
+# The benchmark drives the first configured OBS target, pointed at its stand-in
+TARGET_NAME, TARGET = next(iter(CONFIG["obs"]["targets"].items()))
+
+
+class CountingProxy:
+    """Forwards requests to the mock tracker, counting them by path."""
+
+    def __init__(self, upstream: str):
+        self._upstream = upstream
+        self._session: aiohttp.ClientSession = None
+        self._runner: web.AppRunner = None
+        # Responses still being forwarded, e.g. the bid stream
+        self._upstreams: set[aiohttp.ClientResponse] = set()
+        self.requests: collections.Counter = collections.Counter()
+
+    async def start(self, host: str, port: int):
+        self._session = aiohttp.ClientSession()
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._forward)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        # Otherwise the runner waits for open streams until its shutdown timeout
+        for upstream in self._upstreams:
+            upstream.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
+
+    async def _forward(self, request: web.Request) -> web.StreamResponse:
+        self.requests[request.path] += 1
+        async with self._session.request(
+            request.method,
+            self._upstream + request.path_qs,
+            headers={
+                name: request.headers[name]
+                for name in PROXIED_HEADERS
+                if name in request.headers
+            },
+            data=await request.read(),
+            timeout=aiohttp.ClientTimeout(total=None),
+        ) as upstream:
+            self._upstreams.add(upstream)
+            response = web.StreamResponse(
+                status=upstream.status,
+                headers={
+                    name: upstream.headers[name]
+                    for name in PROXIED_HEADERS
+                    if name in upstream.headers
+                },
+            )
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+            except ConnectionResetError:
+                # The client went away mid-stream, e.g. the autoswitcher shutting down
+                pass
+            except aiohttp.ClientError:
+                # The upstream was closed mid-stream, e.g. by close()
+                pass
+            finally:
+                self._upstreams.discard(upstream)
+            return response
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies: list[float]) -> dict:
+    if not latencies:
+        return None
+    return {
+        "min": round(min(latencies), 3),
+        "p50": round(percentile(latencies, 50), 3),
+        "p90": round(percentile(latencies, 90), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies), 3),
+        "mean": round(statistics.fmean(latencies), 3),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def autoswitcher_overrides(args: argparse.Namespace) -> dict:
+    event: str = CONFIG["main"]["event"]
+    proxy_url = f"http://127.0.0.1:{args.proxy_port}"
+    mock_env: dict = CONFIG["events"][event]["mock"]
+
+    def proxied(url: str) -> str:
+        return url.replace("http://localhost:5000", proxy_url) if url else None
+
+    decision: dict = {}
+    if args.min_margin is not None:
+        decision["min_margin"] = args.min_margin
+    if args.dwell_seconds is not None:
+        decision["dwell_seconds"] = args.dwell_seconds
+    return {
+        "main": {
+            "env": "mock",
+            "stats_interval_seconds": 3600,
+            # Every run starts cold, rather than resuming the last one
+            "ttl_persist_path": None,
+        },
+        "obs": {
+            "targets": {
+                TARGET_NAME: {
+                    **TARGET,
+                    "host": "127.0.0.1",
+                    "port": args.obs_port,
+                    # The stand-in names its scene items after the sources
+                    "source_names": None,
+                }
+            }
+        },
+        "tasbot": {"aninja": os.devnull, "aninja_frame_function": None},
+        "events": {
+            event: {
+                "mock": {
+                    # The mock environment overrides the event's decision settings
+                    "decision": {**mock_env.get("decision", {}), **decision},
+                    "api_base_url": proxied(mock_env["api_base_url"]),
+                    "batch_url": proxied(mock_env["batch_url"]),
+                    "stream_url": (
+                        proxied(mock_env["stream_url"])
+                        if args.mode == "stream"
+                        else None
+                    ),
+                },
+            }
+        },
+    }
+
+
+async def wait_for_mock_tracker(
+    session: aiohttp.ClientSession, mock_tracker: subprocess.Popen, timeout: float
+):
+    deadline = time.monotonic() + timeout
+    while True:
+        if mock_tracker.poll() is not None:
+            raise RuntimeError("The mock tracker exited, is port 5000 already in use?")
+        try:
+            async with session.get(f"{MOCK_TRACKER_URL}/kill") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("The mock tracker didn't start")
+        await asyncio.sleep(0.1)
+
+
+def on_air(source: str):
+    """A predicate for source being on top with only its own input unmuted."""
+    mute_inputs: dict = TARGET["mute_inputs"]
+
+    def predicate(obs: StandInObs) -> bool:
+        return obs.top_source == source and all(
+            obs.mutes.get(input_name) == (input_source != source)
+            for input_source, input_name in mute_inputs.items()
+        )
+
+    return predicate
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    db_snapshot = {
+        path: path.read_bytes() for path in (MOCK_TRACKER_DIR / "db").iterdir()
+    }
+    output = None if args.verbose else subprocess.DEVNULL
+    mock_tracker = subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=MOCK_TRACKER_DIR,
+        stdout=output,
+        stderr=output,
+        start_new_session=True,
+    )
+    proxy = CountingProxy(MOCK_TRACKER_URL)
+    obs = ObsWebSocketStandIn(
+        TARGET["scene"],
+        ["Background", *CONFIG["obs"]["sources"]],
+        password=TARGET["password"],
+        rtt_seconds=args.rtt_ms / 1000,
+    )
+    autoswitcher: subprocess.Popen = None
+    session = aiohttp.ClientSession()
+    try:
+        await wait_for_mock_tracker(session, mock_tracker, timeout=15)
+        await proxy.start("127.0.0.1", args.proxy_port)
+        await obs.start("127.0.0.1", args.obs_port)
+        autoswitcher = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.autoswitcher",
+                json.dumps(autoswitcher_overrides(args)),
+            ],
+            cwd=REPO_ROOT,
+            stdout=output,
+            stderr=output,
+        )
+        await asyncio.wait_for(obs.identified.wait(), timeout=30)
+        # Wait for the autoswitcher to put the current leader on air
+        await obs.wait_for(lambda stand_in: stand_in.mutes, timeout=30)
+        logger.info("Autoswitcher is switching, starting the benchmark")
+
+        obs.requests.clear()
+        proxy.requests.clear()
+        latencies: list[float] = []
+        missed: int = 0
+        started = time.monotonic()
+        for lead_change in range(args.lead_changes):
+            source = "Save" if obs.obs.top_source == "Kill" else "Kill"
+            async with session.post(f"{MOCK_TRACKER_URL}/{source.lower()}") as resp:
+                resp.raise_for_status()
+            landed_at = time.monotonic()
+            try:
+                applied_at = await obs.wait_for(on_air(source), args.timeout)
+                latencies.append((applied_at - landed_at) * 1000)
+                logger.info(f"Lead change {lead_change + 1}: {latencies[-1]:.1f}ms")
+            except asyncio.TimeoutError:
+                missed += 1
+                logger.warning(f"Lead change {lead_change + 1}: not applied")
+            await asyncio.sleep(args.interval)
+        minutes = (time.monotonic() - started) / 60
+    finally:
+        await session.close()
+        if autoswitcher is not None:
+            autoswitcher.send_signal(signal.SIGINT)
+            try:
+                # Keep the loop running, the autoswitcher disconnects from the stand-ins
+                await asyncio.to_thread(autoswitcher.wait, timeout=10)
+            except subprocess.TimeoutExpired:
+                autoswitcher.kill()
+        await obs.close()
+        await proxy.close()
+        os.killpg(mock_tracker.pid, signal.SIGTERM)
+        mock_tracker.wait()
+        for path, contents in db_snapshot.items():
+            path.write_bytes(contents)
+
+    obs_requests = collections.Counter(request_type for _, request_type in obs.requests)
+    return {
+        "benchmark": "lead_change_latency",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "parameters": {
+            "mode": args.mode,
+            "lead_changes": args.lead_changes,
+            "interval_seconds": args.interval,
+            "rtt_ms": args.rtt_ms,
+            "min_margin": args.min_margin,
+            "dwell_seconds": args.dwell_seconds,
+        },
+        "applied": len(latencies),
+        "missed": missed,
+        "latency_ms": summarize(latencies),
+        "obs_requests_per_minute": round(sum(obs_requests.values()) / minutes, 2),
+        "obs_requests_by_type": dict(obs_requests),
+        "tracker_requests_per_minute": round(sum(proxy.requests.values()) / minutes, 2),
+        "tracker_requests_by_path": dict(proxy.requests),
+    }
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--mode",
+        choices=["stream", "poll"],
+        default="stream",
+        help="receive bid updates from the mock tracker's stream, or only poll (default: stream)",
+    )
+    parser.add_argument(
+        "--lead-changes",
+        type=int,
+        default=10,
+        help="how many lead changes to script (default: 10)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=4.0,
+        help="seconds to wait after each lead change (default: 4)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=15.0,
+        help="seconds before a lead change counts as missed (default: 15)",
+    )
+    parser.add_argument(
+        "--rtt-ms",
+        type=float,
+        default=0.0,
+        help="round trip time to inject into every OBS request (default: 0)",
+    )
+    parser.add_argument(
+        "--min-margin",
+        type=float,
+        help="override the decision min_margin from config.py",
+    )
+    parser.add_argument(
+        "--dwell-seconds",
+        type=float,
+        help="override the decision dwell_seconds from config.py",
+    )
+    parser.add_argument("--obs-port", type=int, default=4456)
+    parser.add_argument("--proxy-port", type=int, default=5001)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="show the output of the autoswitcher and mock tracker",
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        style="{",
+        format="{asctime} {levelname} {message}",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    args = parse_args()
+    results = asyncio.run(run_benchmark(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Bid tracker clients.
+
+A bid client knows how to fetch the tracked bids from one kind of event tracker
+and turns its responses into Bid records holding only what the switcher uses,
+with the total already a number. Clients register themselves under the name an
+event's `bid_client` setting refers to, so a new tracker is a new class here and
+nothing else has to change.
+"""
+import abc
+import asyncio
+import functools
+import json
+import logging
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+from metrics import TRACKER_ERRORS, TRACKER_REQUEST_SECONDS
+from tracker import BidLookupError, ResponseCache, get_decoded
+
+
+@dataclass(frozen=True, slots=True)
+class Bid:
+    bid_id: int
+    state: str
+    name: str
+    total: float
+
+
+BID_CLIENTS: dict[str, type] = {}
+
+
+def register_bid_client(name: str):
+    """Class decorator making a bid client available as bid_client `name`."""
+
+    def register(cls):
+        cls.name = name
+        BID_CLIENTS[name] = cls
+        return cls
+
+    return register
+
+
+def create_bid_client(name: str, *args, **kwargs) -> "BidClient":
+    return BID_CLIENTS[name](*args, **kwargs)
+
+
+class BidClient(abc.ABC):
+    name: str = None
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        bid_ids: tuple,
+        api_base_url: str,
+        batch_url: str = None,
+        timeout_seconds: float = 1.0,
+        cache: ResponseCache = None,
+        logger=logging.getLogger(),
+    ):
+        """
+        With a batch_url, every tracked bid is fetched with one request to it,
+        otherwise each bid is fetched from api_base_url + its bid ID.
+        """
+        self._session = session
+        self._bid_ids = bid_ids
+        self._api_base_url = api_base_url
+        self._batch_url = batch_url
+        self._timeout_seconds = timeout_seconds
+        self._cache = cache
+        self._logger = logger
+
+    @abc.abstractmethod
+    async def fetch_bids(self) -> tuple[dict, bool]:
+        """
+        Returns a dict of bid_id -> Bid (or None if that bid could not be fetched
+        this tick), and whether any bid changed since the last fetch. Raises
+        BidLookupError if any bid is misconfigured.
+        """
+
+    @abc.abstractmethod
+    def bids_from_response(
+        self, response: dict, source: str, require_all: bool = True
+    ) -> dict:
+        """
+        Pick the tracked bids out of an already decoded response, such as a bid
+        stream event. Tracked bids missing from it raise BidLookupError, or are
+        left out when require_all is False.
+        """
+
+
+@register_bid_client("gdq_donation_tracker")
+class GdqDonationTrackerClient(BidClient):
+    """The GDQ donation tracker's bid search API."""
+
+    content_type: str = "application/json"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Result IDs are matched as strings, so every response doesn't need converting
+        self._bid_ids_by_key: dict[str, int] = {
+            str(bid_id): bid_id for bid_id in self._bid_ids
+        }
+
+    @staticmethod
+    def decode_bid(result: dict) -> Bid:
+        return Bid(
+            bid_id=result["id"],
+            state=result["state"],
+            name=result["shortdescription"],
+            total=float(result["total"]),
+        )
+
+    def _checked(self, bid: Bid) -> Bid:
+        if bid.state != "OPENED":
+            raise BidLookupError(
+                f"Got bid state {bid.state} for bid_id {bid.bid_id}, make sure that you have the correct bid ID in your config."
+            )
+        return bid
+
+    async def fetch_bids(self) -> tuple[dict, bool]:
+        if self._batch_url:
+            return await self._fetch_batched()
+        return await self._fetch_each()
+
+    def _decode_single(self, bid_id, body: bytes) -> Bid:
+        data = json.loads(body)
+        # we're looking up a bid by it's absolute ID, so we should only ever get one result
+        if data["count"] != 1:
+            raise BidLookupError(
+                f"Got {data['count']} results for bid_id {bid_id}, make sure that you have the correct bid ID in your config."
+            )
+        return self._checked(self.decode_bid(data["results"][0]))
+
+    def _decode_batch(self, body: bytes) -> dict:
+        return self.bids_from_response(json.loads(body), self._batch_url)
+
+    async def _fetch_bid(self, bid_id) -> tuple[Bid, bool]:
+        self._logger.debug("Looking up bid_id: %s", bid_id)
+        started = time.perf_counter()
+        try:
+            bid, changed = await get_decoded(
+                self._session,
+                self._api_base_url + str(bid_id),
+                self._timeout_seconds,
+                functools.partial(self._decode_single, bid_id),
+                self._cache,
+                self.content_type,
+            )
+        except asyncio.TimeoutError:
+            TRACKER_ERRORS.inc("timeout")
+            self._logger.error(
+                f"[HTTP] Timed out after {self._timeout_seconds}s looking up bid_id {bid_id}"
+            )
+            return None, False
+        except aiohttp.ClientError as e:
+            TRACKER_ERRORS.inc("http")
+            self._logger.error(
+                f"[HTTP] We encountered an error while trying to connect to the API: {e}"
+            )
+            return None, False
+        finally:
+            TRACKER_REQUEST_SECONDS.observe(time.perf_counter() - started, str(bid_id))
+        return bid, changed
+
+    async def _fetch_each(self) -> tuple[dict, bool]:
+        # A slow bid only costs its own timeout, it never holds back the others
+        results = await asyncio.gather(
+            *(self._fetch_bid(bid_id) for bid_id in self._bid_ids),
+            return_exceptions=True,
+        )
+        bids: dict = {}
+        any_changed = False
+        for bid_id, result in zip(self._bid_ids, results):
+            if isinstance(result, BidLookupError):
+                raise result
+            if isinstance(result, Exception):
+                TRACKER_ERRORS.inc("other")
+                self._logger.error(f"[HTTP] We encountered an error: {result}")
+                result = (None, False)
+            bids[bid_id], changed = result
+            any_changed = any_changed or changed
+        return bids, any_changed
+
+    async def _fetch_batched(self) -> tuple[dict, bool]:
+        # e.g. all children of the parent bid, so N bids cost one round trip
+        self._logger.debug("Looking up bid_ids %s in one request", self._bid_ids)
+        started = time.perf_counter()
+        try:
+            bids, changed = await get_decoded(
+                self._session,
+                self._batch_url,
+                self._timeout_seconds,
+                self._decode_batch,
+                self._cache,
+                self.content_type,
+            )
+        except BidLookupError:
+            raise
+        except asyncio.TimeoutError:
+            TRACKER_ERRORS.inc("timeout")
+            self._logger.error(
+                f"[HTTP] Timed out after {self._timeout_seconds}s looking up bid_ids {self._bid_ids}"
+            )
+            return {bid_id: None for bid_id in self._bid_ids}, False
+        except aiohttp.ClientError as e:
+            TRACKER_ERRORS.inc("http")
+            self._logger.error(
+                f"[HTTP] We encountered an error while trying to connect to the API: {e}"
+            )
+            return {bid_id: None for bid_id in self._bid_ids}, False
+        except Exception as e:
+            TRACKER_ERRORS.inc("other")
+            self._logger.error(f"[HTTP] We encountered an error: {e}")
+            return {bid_id: None for bid_id in self._bid_ids}, False
+        finally:
+            # A batch covers every tracked bid, so it's timed as one
+            TRACKER_REQUEST_SECONDS.observe(time.perf_counter() - started, "batch")
+        return bids, changed
+
+    def bids_from_response(
+        self, response: dict, source: str, require_all: bool = True
+    ) -> dict:
+        # Only the tracked bids are decoded, the rest of the results are skipped
+        bids: dict = {}
+        for result in response["results"]:
+            bid_id = self._bid_ids_by_key.get(str(result["id"]))
+            if bid_id is not None:
+                bids[bid_id] = self._checked(self.decode_bid(result))
+        if require_all and len(bids) != len(self._bid_ids):
+            missing = [bid_id for bid_id in self._bid_ids if bid_id not in bids]
+            raise BidLookupError(
+                f"bid_id {missing[0]} was not in the {response['count']} results from {source}, make sure that you have the correct bid ID and batch_url in your config."
+            )
+        return bids
+
+
+@register_bid_client("mock_tracker")
+class MockTrackerClient(GdqDonationTrackerClient):
+    """
+    The mock tracker in mock_tracker/. It speaks the GDQ tracker's API, but
+    doesn't promise a JSON Content-Type for everything it serves.
+    """
+
+    content_type = None
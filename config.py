@@ -1,27 +1,59 @@
-import argparse
 import datetime
-from environs import Env 
 
 CONFIG = {
     "main": {
         "event": "agdq2024",
         "env": "prod",
         "ttl_persist_path": "./ttl_persist.json",
+        "stats_interval_seconds": 60,
+        "runtime": {
+            "profile": "prod",
+            "uvloop": False,
+            "slow_callback_seconds": 0.1,
+        },
+        "metrics": {
+            "host": "127.0.0.1",
+            "port": 9108,
+            "loop_lag_interval_seconds": 0.5,
+        },
     },
     "obs": {
-        "host": "127.0.0.1",
-        "port": 4455,
-        "password": "txp7BwUDHuRcakur",
         "ws_update_interval_seconds": 1,
+        "probe_timeout_seconds": 5,
+        "max_reconnect_delay_seconds": 30,
         "sources": [
             "Tie",
             "Kill",
             "Save",
         ],
+        "reverify_interval_seconds": 30,
         "scene_switching_interval_seconds": 1,  # TODO: Remove this
+        "targets": {
+            "main": {
+                "host": "127.0.0.1",
+                "port": 4455,
+                "password": "txp7BwUDHuRcakur",
+                "scene": "Metalive",
+                "mute_inputs": {
+                    "Kill": "Kill animals",
+                    "Save": "Save animals",
+                    "Tie": "Tie animals",
+                },
+                "source_names": None,
+            },
+        },
     },
     "tasbot": {
+        "python": "python3",
         "aninja": "/path/to/aninja.py",
+        "draw_timeout_seconds": 10,
+        "aninja_frame_function": None,
+        "frame_cache_dir": "./.frame_cache",
+        "display": {
+            "width": 32,
+            "height": 8,
+            "pixel_order": "RGB",
+        },
         "images": {
             "kill": "/path/to/kill.png",
             "save": "/path/to/save.png",
@@ -34,6 +66,9 @@ CONFIG = {
             "bid_check_ttl": datetime.timedelta(hours=0, minutes=1, seconds=0),
             "prod": {
                 "api_base_url": "https://gamesdonequick.com/tracker/api/v2/bids/?id=",
+                # e.g. "https://gamesdonequick.com/tracker/api/v2/bids/?parent=<parent bid id>"
+                "batch_url": None,
+                "stream_url": None,
                 "bids_to_track": [
                     {
                         "bid_id": 16115,
@@ -54,6 +89,8 @@ CONFIG = {
             },
             "dev": {
                 "api_base_url": "http://localhost:8000/tracker/api/v2/bids/?id=",  # For testing
+                "batch_url": None,
+                "stream_url": None,
                 "bids_to_track": [
                     {
                         "bid_id": 1,
@@ -73,15 +110,20 @@ CONFIG = {
                 ],
             },
             "mock": {
-                "api_base_url": "http://localhost:5000/",  
+                "bid_client": "mock_tracker",
+                "api_base_url": "http://localhost:5000/tracker/api/v2/bids/?id=",
+                "batch_url": "http://localhost:5000/tracker/api/v2/bids/?parent=5140",
+                "stream_url": "http://localhost:5000/tracker/api/v2/bids/stream",
+                # The mock tracker's lead changes only move the totals by 1
+                "decision": {"min_margin": 1.0},
                 "bids_to_track": [
                     {
-                        "bid_id": "save",
+                        "bid_id": 5141,
                         "friendly_name": "Save the Animals",
                         "source": "Save",
                     },
                     {
-                        "bid_id": "kill",
+                        "bid_id": 5142,
                         "friendly_name": "Kill the Animals",
                         "source": "Kill",
                     },
@@ -93,6 +135,26 @@ CONFIG = {
                 ],
             },
             "poll_interval_seconds": 1,
+            "adaptive_polling": {
+                "enabled": True,
+                "min_interval_seconds": 0.25,
+                "max_interval_seconds": 5,
+                "close_margin": 50.0,
+                "comfortable_margin": 1000.0,
+                "max_error_backoff_seconds": 30,
+            },
+            "decision": {
+                "min_margin": 5.0,
+                "dwell_seconds": 2.0,
+            },
+            "history": {
+                "capacity": 4096,
+                "rate_window_seconds": 60,
+            },
+            "bid_request_timeout_seconds": 0.8,
+            "http_pool_size": 8,
+            "http_keepalive_seconds": 30,
+            "response_cache_ttl_seconds": 30,
         },
     },
 }
@@ -0,0 +1,117 @@
+"""
+N-way bid decision engine.
+
+Decides which source should be on air from the totals of every bid in
+bids_to_track, rather than a hardcoded Kill/Save comparison. The leaders are kept
+in a heap with lazy invalidation, so an update is O(log n) however many options the
+bid war has.
+
+To stop the switcher flapping during near-ties, a new leader has to be ahead of
+the runner up by at least min_margin, and stay the winner for dwell_seconds,
+before it is put on air. An exact tie goes to the bid_to_track without a bid_id
+(the "Tie" source), if there is one.
+"""
+import heapq
+import itertools
+from typing import Mapping
+
+
+class DecisionEngine:
+    def __init__(
+        self,
+        source_by_bid_id: Mapping[int, str],
+        friendly_name_by_bid_id: Mapping[int, str],
+        tie_source: str = None,
+        min_margin: float = 0.0,
+        dwell_seconds=0.0,
+    ):
+        """The tables are the ones compiled into EventSettings."""
+        self._sources = source_by_bid_id
+        self._friendly_names = friendly_name_by_bid_id
+        self._tie_source = tie_source
+        self._min_margin = min_margin
+        self._dwell_seconds = dwell_seconds
+
+        self._sequence = itertools.count()
+        self._totals: dict = {}
+        self._versions: dict = {}
+        self._heap: list = []
+        for bid_id in self._sources:
+            self._push(bid_id, 0.0)
+
+        self.current: str = None
+        self._pending: str = None
+        self._pending_since: float = None
+
+    def friendly_name(self, bid_id) -> str:
+        return self._friendly_names[bid_id]
+
+    def total(self, bid_id) -> float:
+        return self._totals[bid_id]
+
+    def _push(self, bid_id, total: float):
+        version = next(self._sequence)
+        self._totals[bid_id] = total
+        self._versions[bid_id] = version
+        heapq.heappush(self._heap, (-total, version, bid_id))
+
+    def _prune(self):
+        while self._heap and self._versions[self._heap[0][2]] != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def update(self, bid_id, total: float):
+        if bid_id not in self._sources or self._totals[bid_id] == total:
+            return
+        self._push(bid_id, total)
+        if len(self._heap) > 4 * len(self._sources) + 16:
+            # Drop stale entries so the heap stays proportional to the number of bids
+            self._heap = [
+                entry for entry in self._heap if self._versions[entry[2]] == entry[1]
+            ]
+            heapq.heapify(self._heap)
+
+    def leaders(self) -> list[tuple]:
+        """The (bid_id, total) of the leader and the runner up."""
+        self._prune()
+        if not self._heap:
+            return []
+        leader = heapq.heappop(self._heap)
+        self._prune()
+        runner_up = self._heap[0] if self._heap else None
+        heapq.heappush(self._heap, leader)
+        return [
+            (entry[2], -entry[0]) for entry in (leader, runner_up) if entry is not None
+        ]
+
+    def decide(self, now: float) -> str:
+        """The source that should be on air at monotonic time now."""
+        leaders = self.leaders()
+        if not leaders:
+            return self.current
+        leader, leader_total = leaders[0]
+        runner_up_total = leaders[1][1] if len(leaders) > 1 else 0.0
+        margin = leader_total - runner_up_total
+
+        if margin == 0:
+            candidate = self._tie_source or self.current
+        elif margin >= self._min_margin or self.current is None:
+            candidate = self._sources[leader]
+        else:
+            candidate = self.current
+
+        if self.current is None or candidate == self.current:
+            self.current = candidate
+            self._pending = None
+            return self.current
+        if candidate != self._pending:
+            self._pending, self._pending_since = candidate, now
+        if now - self._pending_since >= self._dwell_seconds:
+            self.current = candidate
+            self._pending = None
+        return self.current
+
+    def pending_remaining(self, now: float) -> float:
+        """Seconds until a pending switch would be put on air, or None."""
+        if self._pending is None:
+            return None
+        return max(self._dwell_seconds - (now - self._pending_since), 0.0)
@@ -0,0 +1,138 @@
+"""
+Non-blocking TASBot eye driver.
+
+Eye changes are handed to one long-lived aninja worker process over a pipe
+instead of booting a new interpreter inside the event loop for every change.
+Requests coalesce, so if the eyes change several times while a frame is being
+drawn only the latest state is drawn next. The worker is restarted, with
+backoff, if it dies. When aninja exposes a raw frame function, eye images are
+pushed as frames pre-rendered by frames.FrameCache instead of being decoded by
+aninja on every change.
+"""
+import asyncio
+import logging
+from pathlib import Path
+
+from frames import FrameCache
+
+WORKER_PATH = Path(__file__).parent / "aninja_worker.py"
+
+
+class EyeDriver:
+    def __init__(
+        self,
+        python: str,
+        aninja: str,
+        images: dict[str, str],
+        frame_function: str = None,
+        frame_cache: FrameCache = None,
+        draw_timeout_seconds: float = 10.0,
+        max_restart_delay_seconds: float = 30.0,
+        logger=logging.getLogger(),
+    ):
+        self._python = python
+        self._aninja = aninja
+        self._images = images
+        self._frame_function = frame_function
+        self._frame_cache = frame_cache
+        self._draw_timeout_seconds = draw_timeout_seconds
+        self._max_restart_delay_seconds = max_restart_delay_seconds
+        self._logger = logger
+        self._process: asyncio.subprocess.Process = None
+        self._pending: str = None
+        self._drawn: str = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def show(self, state: str) -> str:
+        """
+        Queue state to be drawn and return immediately. Returns the state, or None if
+        there is no image configured for it.
+        """
+        state = state.lower()
+        if state not in self._images:
+            self._logger.warning(
+                f"[ANINJA] Invalid state: {state}, unable to switch eyes"
+            )
+            return None
+        self._logger.debug("[ANINJA] Switching eyes to %s", state)
+        self._pending = state
+        self._wake.set()
+        self.start()
+        return state
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._stop_worker()
+
+    async def _run(self):
+        restart_delay = 0.5
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            state = self._pending
+            if state is None or state == self._drawn:
+                continue
+            try:
+                await self._draw(state)
+                self._drawn = state
+                restart_delay = 0.5
+            except Exception as e:
+                self._logger.error(
+                    f"[ANINJA] Error drawing {state}: {e}, restarting worker in {restart_delay}s"
+                )
+                await self._stop_worker()
+                await asyncio.sleep(restart_delay)
+                restart_delay = min(restart_delay * 2, self._max_restart_delay_seconds)
+                # Retry unless something newer already replaced it
+                self._wake.set()
+
+    async def _draw(self, state: str):
+        process = await self._ensure_worker()
+        prepared = (
+            await self._frame_cache.get(state)
+            if self._frame_cache is not None and self._frame_function
+            else None
+        )
+        if prepared is not None:
+            message = f"frames\t{prepared.digest}\t{prepared.path}\t{prepared.width}\t{prepared.height}"
+        else:
+            message = self._images[state]
+        process.stdin.write(f"{message}\n".encode())
+        await process.stdin.drain()
+        reply = await asyncio.wait_for(
+            process.stdout.readline(), timeout=self._draw_timeout_seconds
+        )
+        if not reply:
+            raise RuntimeError("worker exited")
+        reply = reply.decode().strip()
+        if reply != "ok":
+            raise RuntimeError(reply)
+        self._logger.debug("[ANINJA] Eyes are now %s", state)
+
+    async def _ensure_worker(self) -> asyncio.subprocess.Process:
+        if self._process is None or self._process.returncode is not None:
+            args = [str(WORKER_PATH), self._aninja]
+            if self._frame_function:
+                args.append(self._frame_function)
+            self._process = await asyncio.create_subprocess_exec(
+                self._python,
+                *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            self._logger.info(f"[ANINJA] Started worker (pid {self._process.pid})")
+        return self._process
+
+    async def _stop_worker(self):
+        process, self._process = self._process, None
+        if process is None or process.returncode is not None:
+            return
+        process.kill()
+        await process.wait()
@@ -0,0 +1,138 @@
+"""
+Pre-rendered frame cache for TASBot's eye images.
+
+Each configured image is decoded once and converted into the display's raw frame
+format (width x height pixels, 3 bytes per pixel in the display's channel order,
+every frame of an animated image back to back). Frames are written to an on-disk
+cache keyed by the image's content hash, so a restart doesn't decode again, and an
+eye change only has to push prepared bytes. An image is re-prepared when its file
+changes.
+
+Decoding needs Pillow, which is optional. Without it nothing is prepared and the
+eye driver falls back to having aninja draw the image file itself.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class PreparedFrames:
+    digest: str
+    path: Path
+    width: int
+    height: int
+    frame_count: int
+    source_mtime_ns: int
+    source_size: int
+
+
+class FrameCache:
+    def __init__(
+        self,
+        images: dict[str, str],
+        cache_dir: str,
+        width: int,
+        height: int,
+        pixel_order: str = "RGB",
+        logger=logging.getLogger(),
+    ):
+        self._images = images
+        self._cache_dir = Path(cache_dir)
+        self._width = width
+        self._height = height
+        self._pixel_order = pixel_order
+        self._logger = logger
+        self._prepared: dict[str, PreparedFrames] = {}
+
+    def prepare(self):
+        """Prepare every configured image. Blocking, run it off the event loop."""
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            self._logger.warning(
+                "[FRAMES] Pillow is not installed, eye images will be drawn from their files"
+            )
+            return
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        for state in self._images:
+            self._prepare(state)
+
+    async def get(self, state: str) -> PreparedFrames:
+        """The prepared frames for state, re-preparing them if the image changed."""
+        prepared = self._prepared.get(state)
+        if prepared is None:
+            return None
+        try:
+            stat = os.stat(self._images[state])
+        except OSError:
+            return prepared
+        if (stat.st_mtime_ns, stat.st_size) != (
+            prepared.source_mtime_ns,
+            prepared.source_size,
+        ):
+            self._logger.info(f"[FRAMES] {self._images[state]} changed, re-preparing")
+            await asyncio.to_thread(self._prepare, state)
+        return self._prepared.get(state)
+
+    def _prepare(self, state: str):
+        image_path = self._images[state]
+        try:
+            stat = os.stat(image_path)
+            with open(image_path, "rb") as f:
+                content = f.read()
+        except OSError as e:
+            self._logger.error(f"[FRAMES] Unable to read {image_path}: {e}")
+            self._prepared.pop(state, None)
+            return
+        digest = hashlib.sha256(
+            content + f"{self._width}x{self._height}:{self._pixel_order}".encode()
+        ).hexdigest()
+        frames_path = self._cache_dir / f"{digest}.frames"
+        frame_size = self._width * self._height * 3
+        if not frames_path.exists():
+            try:
+                raw = self._render(image_path)
+            except Exception as e:
+                self._logger.error(f"[FRAMES] Unable to decode {image_path}: {e}")
+                self._prepared.pop(state, None)
+                return
+            tmp_path = frames_path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(raw)
+            os.replace(tmp_path, frames_path)
+        self._prepared[state] = PreparedFrames(
+            digest=digest,
+            path=frames_path,
+            width=self._width,
+            height=self._height,
+            frame_count=frames_path.stat().st_size // frame_size,
+            source_mtime_ns=stat.st_mtime_ns,
+            source_size=stat.st_size,
+        )
+        self._logger.debug(
+            "[FRAMES] Prepared %s (%d frame(s))",
+            state,
+            self._prepared[state].frame_count,
+        )
+
+    def _render(self, image_path: str) -> bytes:
+        from PIL import Image, ImageSequence
+
+        channels = ["RGB".index(channel) for channel in self._pixel_order]
+        raw = bytearray()
+        with Image.open(image_path) as image:
+            for frame in ImageSequence.Iterator(image):
+                rgb = frame.convert("RGB").resize((self._width, self._height))
+                pixels = rgb.tobytes()
+                if channels == [0, 1, 2]:
+                    raw += pixels
+                    continue
+                reordered = bytearray(len(pixels))
+                for offset, channel in enumerate(channels):
+                    reordered[offset::3] = pixels[channel::3]
+                raw += reordered
+        return bytes(raw)
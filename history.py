@@ -0,0 +1,113 @@
+"""
+Bid total history.
+
+Keeps a fixed-size ring buffer of (timestamp, total) samples per bid in typed
+arrays, so memory stays bounded however long the marathon runs. Totals are
+treated as a step function between samples, which means a sample only needs
+recording when a total changes.
+"""
+import bisect
+import time
+from array import array
+
+
+class BidHistory:
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._totals = array("d", bytes(8 * capacity))
+        self._start: int = 0
+        self._count: int = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> tuple[float, float]:
+        """The (timestamp, total) of a sample, oldest first; negative indexes count from the newest."""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("BidHistory index out of range")
+        position = (self._start + index) % self._capacity
+        return self._times[position], self._totals[position]
+
+    def append(self, timestamp: float, total: float):
+        if self._count < self._capacity:
+            position = (self._start + self._count) % self._capacity
+            self._count += 1
+        else:
+            position = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._times[position] = timestamp
+        self._totals[position] = total
+
+    def latest(self) -> tuple[float, float]:
+        return self[-1] if self._count else None
+
+    def total_at(self, timestamp: float) -> tuple[float, float]:
+        """The newest sample at or before timestamp, or the oldest sample if none is."""
+        if not self._count:
+            return None
+        # Samples are appended in time order, so binary search the logical indexes
+        index = bisect.bisect_right(
+            range(self._count),
+            timestamp,
+            key=lambda index: self._times[(self._start + index) % self._capacity],
+        )
+        return self[max(index - 1, 0)]
+
+    def rate(self, window_seconds: float, now: float = None) -> float:
+        """How fast the total has been growing over the window, in dollars per second."""
+        if not self._count:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        then, then_total = self.total_at(now - window_seconds)
+        elapsed = now - max(then, now - window_seconds)
+        if elapsed <= 0:
+            return 0.0
+        return (self[-1][1] - then_total) / elapsed
+
+
+class BidHistories:
+    def __init__(self, bid_ids, capacity: int, rate_window_seconds: float):
+        self._histories: dict = {bid_id: BidHistory(capacity) for bid_id in bid_ids}
+        self._rate_window_seconds = rate_window_seconds
+
+    def __getitem__(self, bid_id) -> BidHistory:
+        return self._histories[bid_id]
+
+    def record(self, bid_id, total: float, now: float = None):
+        history: BidHistory = self._histories.get(bid_id)
+        if history is None:
+            return
+        latest = history.latest()
+        if latest is None or latest[1] != total:
+            history.append(time.monotonic() if now is None else now, total)
+
+    def rates(self, now: float = None) -> dict:
+        return {
+            bid_id: history.rate(self._rate_window_seconds, now)
+            for bid_id, history in self._histories.items()
+        }
+
+    def projected_lead_change(self, now: float = None) -> float:
+        """
+        Seconds until the runner up would overtake the leader at the current rates,
+        or None if the lead isn't shrinking.
+        """
+        now = time.monotonic() if now is None else now
+        standings = sorted(
+            (
+                (history.latest()[1], history.rate(self._rate_window_seconds, now))
+                for history in self._histories.values()
+                if len(history)
+            ),
+            reverse=True,
+        )
+        if len(standings) < 2:
+            return None
+        (leader_total, leader_rate), (runner_up_total, runner_up_rate) = standings[:2]
+        closing_rate = runner_up_rate - leader_rate
+        if closing_rate <= 0:
+            return None
+        return (leader_total - runner_up_total) / closing_rate
@@ -5,21 +5,50 @@ tasbot_obs_autoswitcher
 Automated video switcher for OBS based on external conditions.
 Cody Wilson <cody@codywilson.co>
 """
-import aiohttp
 import asyncio
+import dataclasses
 import datetime
-import json
+import functools
 import logging
-import os
-from subprocess import call as call_subprocess
+import time
 import simpleobsws
 
-from enum import Enum
-from pathlib import Path
-from websockets import exceptions as websocket_exceptions
-
+from adaptive import AdaptivePollInterval
+from bid_clients import Bid, BidClient, create_bid_client
 from config import CONFIG
+from decision import DecisionEngine
+from eyes import EyeDriver
+from frames import FrameCache
+from history import BidHistories
+from metrics import (
+    EYE_CHANGES,
+    SWITCHES,
+    TRACKER_ERRORS,
+    EventLoopLagMonitor,
+    MetricsServer,
+)
+from recording import (
+    Clock,
+    Recorder,
+    StandInEyes,
+    StandInObs,
+    decisions,
+    read_log,
+)
+from runtime import PROFILES, Runtime
+from settings import (
+    ConfigError,
+    EventSettings,
+    ObsSettings,
+    Settings,
+    compile_config,
+)
+from snapshot import SnapshotWriter, load_snapshot
+from stream import BidStream
+from targets import ObsTarget, ObsTargets
 from timer import Timer
+from tracker import BidLookupError, ResponseCache, create_tracker_session
+from workers import Consumer, LatestValueChannel
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,70 +59,143 @@ logging.basicConfig(
 
 ### OBS Websocket Constants
 OBS_WEBSOCKET_PARAMETERS = simpleobsws.IdentificationParameters()
-OBS_WEBSOCKET_PARAMETERS.eventSubscriptions = (1 << 0) | (1 << 2)
+# General | Scenes | Inputs | SceneItems
+OBS_WEBSOCKET_PARAMETERS.eventSubscriptions = (1 << 0) | (1 << 2) | (1 << 3) | (1 << 7)
 
 ### Global Variables
+settings: Settings = None
 run_started: bool = False
 run_started_at: datetime.datetime = None
 run_ttl_expired: bool = False
-api_bid_data: dict = {"Save": 0.0, "Kill": 0.0}
-last_api_bid_data: dict = {"Save": 0.0, "Kill": 0.0}
+api_bid_data: dict = {}
+bid_histories: BidHistories = None
 tasbot_eye_state: str = ""
+tracker_session = None
+tracker_cache: ResponseCache = None
+bid_client: BidClient = None
+bid_stream: BidStream = None
+bid_channel: LatestValueChannel = None
+bid_consumer: Consumer = None
+decision_engine: DecisionEngine = None
+redecision_task: asyncio.Task = None
+eye_task: asyncio.Task = None
+desired_eye_state: str = None
+clock = Clock()
+recorder: Recorder = None
+metrics_server: MetricsServer = None
+loop_lag_monitor: EventLoopLagMonitor = None
+snapshot_writer: SnapshotWriter = None
 
 
 ### OBS Websocket
-ws = simpleobsws.WebSocketClient(
-    url=f"ws://{CONFIG['obs']['host']}:{CONFIG['obs']['port']}",
-    password=CONFIG["obs"]["password"],
-    identification_parameters=OBS_WEBSOCKET_PARAMETERS,
-)
+obs_targets: ObsTargets = None
+frame_cache: FrameCache = None
+eye_driver: EyeDriver = None
+
+
+def create_clients():
+    global frame_cache
+    global eye_driver
+    tasbot = settings.tasbot
+    frame_cache = FrameCache(
+        images=tasbot.images,
+        cache_dir=tasbot.frame_cache_dir,
+        width=tasbot.display.width,
+        height=tasbot.display.height,
+        pixel_order=tasbot.display.pixel_order,
+    )
+    eye_driver = EyeDriver(
+        python=tasbot.python,
+        aninja=tasbot.aninja,
+        images=tasbot.images,
+        frame_function=tasbot.aninja_frame_function,
+        frame_cache=frame_cache,
+        draw_timeout_seconds=tasbot.draw_timeout_seconds,
+    )
 
 
 ### Persistence
-class PersistenceAction(Enum):
-    READ = 1
-    WRITE = 2
-    DELETE = 3
-
-
-async def on_switchedscenes(eventData):
-    scene_name = eventData["sceneName"]
-    if scene_name == "Metalive":  # TODO: Make this configurable
-        await engage_auto_switcher()
+def snapshot_state() -> dict:
+    event = settings.event
+    return {
+        "event": event.name,
+        "env": event.env,
+        "run_started_at": run_started_at.isoformat() if run_started else None,
+        "run_ttl_expired": run_ttl_expired,
+        "totals": {
+            str(bid_id): decision_engine.total(bid_id) for bid_id in event.bid_ids
+        },
+        "on_air": obs_targets.source,
+        "eye": tasbot_eye_state or None,
+    }
 
 
-async def load_persistence_file(persistence_file_path: Path):
-    try:
-        with open(persistence_file_path, "r") as f:
-            data = json.load(f)
-            run_started = data["run_started"]
-            run_started_at = datetime.datetime.strptime(
-                data["run_started_at"], "%Y-%m-%d %H:%M:%S"
-            )
-            return run_started, run_started_at
-    except FileNotFoundError:
-        return False, None
-    except Exception as e:
-        logging.error(f"Error loading persistence file: {e}")
-        return False, None
+def save_snapshot():
+    if snapshot_writer is not None:
+        snapshot_writer.update(snapshot_state())
 
 
-async def write_persistence_file(persistence_file_path: Path):
+def restore_snapshot(
+    snapshot: dict, bid_check_ttl: datetime.timedelta, logger=logging.getLogger()
+):
+    """
+    Pick up where the snapshot left off, so a restart mid-run doesn't wait for the
+    run's scene to come up again or re-learn the bid totals.
+    """
+    global run_started
+    global run_started_at
+    global run_ttl_expired
+    global tasbot_eye_state
+    event = settings.event
+    if snapshot.get("event") != event.name or snapshot.get("env") != event.env:
+        logger.info("[SNAPSHOT] Snapshot is from another event, starting fresh")
+        return
     try:
-        with open(persistence_file_path, "rw+") as f:
-            global run_started
-            global run_started_at
-            data = {
-                "run_started": run_started,
-                "run_started_at": run_started_at.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            if json.load(f.read()) != data:
-                json.dump(data, f)
-                return True
-            else:
-                return False
-    except FileExistsError:
-        return False
+        started_at = snapshot["run_started_at"]
+        started_at = started_at and datetime.datetime.fromisoformat(started_at)
+        ttl_expired = bool(snapshot["run_ttl_expired"])
+        totals = {
+            bid_id: float(snapshot["totals"][str(bid_id)])
+            for bid_id in event.bid_ids
+            if str(bid_id) in snapshot["totals"]
+        }
+        on_air = snapshot["on_air"]
+        eye = snapshot["eye"]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"[SNAPSHOT] Ignoring malformed snapshot: {e!r}")
+        return
+    if on_air not in settings.obs.sources:
+        on_air = None
+    if started_at:
+        # A restart doesn't give the run a fresh TTL window
+        run_started = True
+        run_started_at = started_at
+        run_ttl_expired = (
+            ttl_expired or datetime.datetime.now() > started_at + bid_check_ttl
+        )
+    if not run_in_progress():
+        # Outside a run, or once its TTL is up, what's on air is up to the operator
+        on_air = None
+    now = clock.now()
+    for bid_id, total in totals.items():
+        decision_engine.update(bid_id, total)
+        bid_histories.record(bid_id, total, now)
+        api_bid_data[decision_engine.friendly_name(bid_id)] = total
+    if on_air is not None:
+        decision_engine.current = on_air
+        # Each target checks this is what's on air as soon as it connects
+        obs_targets.restore(on_air)
+        tasbot_eye_state = eye or ""
+        switch_eyes(on_air.lower())
+    logger.info(
+        f"[SNAPSHOT] Resuming with {on_air} on air, "
+        + (
+            f"run started at: {run_started_at.strftime('%Y-%m-%d %H:%M:%S')}"
+            + (", past its TTL" if run_ttl_expired else "")
+            if run_started
+            else "no run in progress"
+        )
+    )
 
 
 async def engage_auto_switcher():
@@ -107,6 +209,7 @@ async def engage_auto_switcher():
     logging.info(
         f"[SWITCHER] Run started at: {run_started_at.strftime('%Y-%m-%d %H:%M:%S')}"
     )
+    save_snapshot()
 
 
 async def update_eye_state(eye_state: str):
@@ -114,280 +217,560 @@ async def update_eye_state(eye_state: str):
     tasbot_eye_state = eye_state
 
 
-async def switch_active_media(to_the_top: str, logger=logging.getLogger()):
-    get_scene_item_list_request = simpleobsws.Request(
-        "GetSceneItemList", {"sceneName": "Metalive"}
-    )
-    scene_items_list_response = await ws.call(get_scene_item_list_request)
-    scene_items_list: list[dict] = scene_items_list_response.responseData["sceneItems"]
-    # search each scene item for the one we want to move (sceneItemName == to_the_top)
-    id_scene_item_to_move: int = None
-    top_scene_item_index: int = max(
-        tuple(map(lambda x: x["sceneItemIndex"], scene_items_list))
-    )
-    logging.debug(f"top_scene_item_index: {top_scene_item_index}")
-    for scene_item in scene_items_list:
-        if scene_item["sourceName"] == to_the_top:
-            id_scene_item_to_move = scene_item["sceneItemId"]
-            logging.debug(f"Found {to_the_top} at index {scene_item['sceneItemIndex']}")
-            if scene_item["sceneItemIndex"] == top_scene_item_index:
-                logging.debug(f"{to_the_top} is already at the top of the scene")
-                return
-
-    if id_scene_item_to_move is None:
-        logger.error(f"Could not find sceneItemIndex with name {to_the_top}")
-        return
-    set_scene_item_index_request = simpleobsws.Request(
-        "SetSceneItemIndex",
-        {
-            "sceneName": "Metalive",
-            "sceneItemId": id_scene_item_to_move,
-            "sceneItemIndex": top_scene_item_index,
-        },
-    )
+def switch_active_media(to_the_top: str, detected_at: float = None):
+    # Every OBS target and TASBot's eyes switch concurrently, each in its own task
+    obs_targets.switch(to_the_top, detected_at)
+    switch_eyes(to_the_top.lower())
+
+
+def switch_eyes(state: str):
+    global desired_eye_state
+    global eye_task
+    desired_eye_state = state
+    if eye_task is None or eye_task.done():
+        eye_task = asyncio.create_task(show_desired_eye_state())
+
+
+async def show_desired_eye_state():
+    # Eye changes made while one is being drawn are picked up right after
+    while tasbot_eye_state != desired_eye_state:
+        if await apply_eye_state(desired_eye_state) is None:
+            # Try again on the next reverify
+            return
 
-    # TODO: Abstract this magic bullshit
-    input_list_to_the_top_map: dict[str, str] = {
-        "Kill": "Kill animals",
-        "Save": "Save animals",
-        "Tie": "Tie animals",
-    }
-    input_mute_requests: list[simpleobsws.Request] = []
-    for (
-        key,
-        val,
-    ) in input_list_to_the_top_map.items():
-        input_muted = True if key != to_the_top else False
-        input_mute_requests.append(
-            simpleobsws.Request(
-                "SetInputMute", {"inputName": val, "inputMuted": input_muted}
-            )
-        )
 
-    logging.info(f"[SWITCHER] Setting {to_the_top} as the top scene item")
-    await ws.call(set_scene_item_index_request)
-    logging.info(f"[SWITCHER] Muting all inputs except {to_the_top}")
-    for request in input_mute_requests:
-        await ws.call(request)
+async def apply_eye_state(state: str):
+    eye_state = await tasbot_switch_eyes(state)
+    if eye_state is not None and eye_state != tasbot_eye_state:
+        EYE_CHANGES.inc(eye_state)
+    await update_eye_state(eye_state)
+    save_snapshot()
+    return eye_state
 
 
 async def tasbot_switch_eyes(state: str, logger=logging.getLogger()):
-    global CONFIG
-    TASBOT_CONFIG = CONFIG["tasbot"]
-    global tasbot_eye_state
-    PATH_TO_ANINJA = TASBOT_CONFIG["aninja"]
-    logger.debug(f"[ANINJA] Switching eyes to {state}")
-    logger.debug(f"[ANINJA] Current eye state: {tasbot_eye_state}")
+    logger.debug("[ANINJA] Current eye state: %s", tasbot_eye_state)
+    return await eye_driver.show(state)
 
-    if state.lower() == "kill":
-        if tasbot_eye_state != "kill":
-            try:
-                call_subprocess(
-                    [
-                        "python3",
-                        PATH_TO_ANINJA,
-                        TASBOT_CONFIG["images"]["kill"],
-                    ]
-                )
 
-            except Exception as e:
-                logging.error(f"[ANINJA] Error: {e}")
-        return "kill"
-    elif state.lower() == "save":
-        if tasbot_eye_state != "save":
-            try:
-                call_subprocess(
-                    [
-                        "python3",
-                        PATH_TO_ANINJA,
-                        TASBOT_CONFIG["images"]["save"],
-                    ]
-                )
-            except Exception as e:
-                logging.error(f"[ANINJA] Error: {e}")
-        return "save"
-    elif state.lower() == "tie":
-        if tasbot_eye_state != "tie":
-            try:
-                call_subprocess(
-                    [
-                        "python3",
-                        PATH_TO_ANINJA,
-                        TASBOT_CONFIG["images"]["tie"],
-                    ]
-                )
-            except Exception as e:
-                logging.error(f"[ANINJA] Error: {e}")
-        return "tie"
+def update_poll_interval(context, timer, tracker_bids: dict):
+    adaptive_poll_interval: AdaptivePollInterval = context["adaptive_poll_interval"]
+    if adaptive_poll_interval is None:
+        return
+    if tracker_bids is None or any(bid is None for bid in tracker_bids.values()):
+        adaptive_poll_interval.error()
     else:
-        logging.warning(f"[ANINJA] Invalid state: {state}, unable to switch eyes")
+        adaptive_poll_interval.observe(
+            (bid.total for bid in tracker_bids.values()),
+            lead_change_in=bid_histories.projected_lead_change(clock.now()),
+        )
+    timer.set_interval(adaptive_poll_interval.next_interval())
+    context["logger"].debug("[POLL] Next poll in %.2fs", timer.interval)
 
 
-async def tasbot_obs_autoswitcher_callback_v2(timer_name, context, timer):
-    global api_bid_data
-    global last_api_bid_data
-    global run_started
-    global run_started_at
+def run_in_progress() -> bool:
+    return run_started and not run_ttl_expired
+
+
+def auto_switcher_active(context) -> bool:
     global run_ttl_expired
+    if not run_in_progress():
+        return False
+    if datetime.datetime.now() > run_started_at + context["bid_check_ttl"]:
+        context["logger"].info(
+            "[SWITCHER] Run has exceeded the TTL, disabling the auto switcher!"
+        )
+        run_ttl_expired = True
+        save_snapshot()
+        return False
+    return True
+
+
+async def switch_to_bid_leader(tracker_bids: dict, logger=logging.getLogger()):
+    global api_bid_data
+    # When the oldest of these changes was published by the poller or the stream
+    detected_at = time.monotonic() - bid_consumer.last_wait
+    for bid_id, bid in tracker_bids.items():
+        if bid is not None:
+            decision_engine.update(bid_id, bid.total)
+            api_bid_data[decision_engine.friendly_name(bid_id)] = bid.total
+    if logger.isEnabledFor(logging.DEBUG):
+        for key, value in api_bid_data.items():
+            logger.debug("[BID DATA] %s: %s", key, value)
+    await apply_decision(logger, detected_at)
+
+
+async def apply_decision(logger=logging.getLogger(), detected_at: float = None):
+    global redecision_task
+    now = clock.now()
+    source = decision_engine.decide(now)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "[DECISION] Leaders: %s, on air: %s", decision_engine.leaders(), source
+        )
+    if source is not None:
+        if obs_targets.source != source:
+            record_event("decision", source=source)
+            SWITCHES.inc(source)
+            switch_active_media(source, detected_at)
+    save_snapshot()
+    remaining = decision_engine.pending_remaining(now)
+    if redecision_task is not None and redecision_task is not asyncio.current_task():
+        redecision_task.cancel()
+        redecision_task = None
+    if remaining is not None:
+        # A new leader is waiting out its dwell time, check again once it has
+        logger.debug("[DECISION] Switch pending, re-checking in %.2fs", remaining)
+        redecision_task = asyncio.create_task(
+            redecide_after(remaining, logger, detected_at)
+        )
+
+
+async def redecide_after(
+    delay: float, logger=logging.getLogger(), detected_at: float = None
+):
+    await clock.sleep(delay)
+    try:
+        await apply_decision(logger, detected_at)
+    except Exception:
+        logger.exception("[DECISION] Error re-checking the bid leader")
+
+
+def record_event(kind: str, **fields):
+    if recorder is not None:
+        recorder.record(kind, **fields)
+
+
+def record_tracker_bids(tracker_bids: dict, source: str, changed: bool = True):
+    record_event(
+        "tracker",
+        source=source,
+        changed=changed,
+        bids=[
+            [bid_id, None if bid is None else dataclasses.asdict(bid)]
+            for bid_id, bid in tracker_bids.items()
+        ],
+    )
+
 
-    if not run_started:
-        get_current_scene_request = simpleobsws.Request("GetCurrentProgramScene")
-        response = await ws.call(get_current_scene_request)
-        current_scene_name = response.responseData["currentProgramSceneName"]
-        if current_scene_name == "Metalive":  # TODO: Make this configurable
-            await engage_auto_switcher()
-    bids_to_track: list[dict] = context["bids_to_track"]
-    base_url: str = context["base_url"]
+def publish_bids(tracker_bids: dict, source: str):
+    now = clock.now()
+    for bid_id, bid in tracker_bids.items():
+        if bid is not None:
+            bid_histories.record(bid_id, bid.total, now)
+            bid_channel.publish(bid_id, bid, source)
+
+
+async def on_stream_bids(context, tracker_bids: dict):
+    if auto_switcher_active(context):
+        record_tracker_bids(tracker_bids, "stream")
+        publish_bids(tracker_bids, "stream")
+
+
+async def tasbot_obs_autoswitcher_callback_v2(timer_name, context, timer):
+    if not run_started and await obs_targets.any_live():
+        await engage_auto_switcher()
     logger = context["logger"]
-    if run_started and not run_ttl_expired:
+    if auto_switcher_active(context):
+        # Poll until there is something on air, the stream's first update may have
+        # arrived before the run was engaged
+        if (
+            bid_stream is not None
+            and bid_stream.connected
+            and decision_engine.current is not None
+        ):
+            logger.debug("[STREAM] Bid stream is connected, skipping poll")
+            return
         logger.info("--------------------")
-        if datetime.datetime.now() > run_started_at + context["bid_check_ttl"]:
-            logger.info(
-                "[SWITCHER] Run has exceeded the TTL, disabling the auto switcher!"
-            )
-            run_ttl_expired = True
+        try:
+            tracker_bids, changed = await bid_client.fetch_bids()
+        except BidLookupError as e:
+            TRACKER_ERRORS.inc("lookup")
+            logger.error(e)
+            record_event("tracker_error", error=str(e))
+            update_poll_interval(context, timer, None)
             return
-        async with aiohttp.ClientSession() as session:
-            for bid_type in bids_to_track:
-                if bid_type["bid_id"] is not None:
-                    logger.debug(f"Looking up bid_id: {bid_type['bid_id']}")
-                    try:
-                        async with session.get(
-                            base_url + str(bid_type["bid_id"])
-                        ) as resp:
-                            if resp.status == 200:
-                                logger.debug("Found bid_id, parsing response")
-                                data = (
-                                    await resp.json(
-                                        content_type="application/octet-stream"
-                                    )
-                                    if resp.content_type == "application/octet-stream"
-                                    else await resp.json()
-                                )
-                                if (
-                                    data["count"] == 1
-                                ):  # we're looking up a bid by it's absolute ID, so we should only ever get one result
-                                    tracker_bid_data = data["results"][0]
-                                    if tracker_bid_data["state"] == "OPENED":
-                                        api_bid_data[
-                                            tracker_bid_data["shortdescription"]
-                                        ] = float(tracker_bid_data["total"])
-                                    else:
-                                        logger.error(
-                                            f"Got bid state {tracker_bid_data['state']} for bid_id {bid_type['bid_id']}, make sure that you have the correct bid ID in your config."
-                                        )
-                                        return
-                                else:
-                                    logger.error(
-                                        f"Got {data['count']} results for bid_id {bid_type['bid_id']}, make sure that you have the correct bid ID in your config."
-                                    )
-                                    return
-                    except aiohttp.ClientConnectorError as e:
-                        logger.error(
-                            f"[HTTP] We encountered an error while trying to connect to the API: {e}"
-                        )
-                        
-                    except aiohttp.ClientResponseError as e:
-                        logger.error(
-                            f"[HTTP] We encountered an error while trying to connect to the API: {e}"
-                        )
-                        pass
-                    except Exception as e:
-                        logger.error(f"[HTTP] We encountered an error: {e}")
-                        pass
-        for key, value in api_bid_data.items():
-            logger.debug(f"[BID DATA] {key}: {value}")
-        if api_bid_data["Kill the Animals"] > api_bid_data["Save the Animals"]:
-            logger.debug("[BID DATA] Kill > Save")
-            await switch_active_media("Kill")
-            eye_state = await tasbot_switch_eyes("kill")
-            await update_eye_state(eye_state)
-        elif api_bid_data["Kill the Animals"] < api_bid_data["Save the Animals"]:
-            logger.debug("[BID DATA] Save > Kill")
-            await switch_active_media("Save")
-            global tasbot_eye_state
-            eye_state = await tasbot_switch_eyes("save")
-            await update_eye_state(eye_state)
-        else:
-            logger.debug("[BID DATA] Kill == Save")
-            await switch_active_media("Tie")
-            global tasbot_eye_state
-            eye_state = await tasbot_switch_eyes("tie")
-            await update_eye_state(eye_state)
+        record_tracker_bids(tracker_bids, "poll", changed)
+        update_poll_interval(context, timer, tracker_bids)
+        if not changed:
+            logger.debug("[BID DATA] No change since the last poll")
+            return
+        publish_bids(tracker_bids, "poll")
     return
 
 
-async def init():
-    global run_started
-    global run_started_at
-    try:
-        await ws.connect()
-    except websocket_exceptions.InvalidStatusCode as e:
-        logging.error(
-            f"Could not connect to OBS Websocket, please check your configuration: {e}"
-        )
-        exit(1)
-    except ConnectionRefusedError as e:
-        logging.error(
-            f"Could not connect to OBS Websocket. Is OBS running and, is the websocket plugin activated? If so, please check your configuration: {e}"
+async def reverify_on_air_state_callback(timer_name, context, timer):
+    # Outside a run, or once its TTL is up, what's on air is up to the operator
+    if not auto_switcher_active(context):
+        return
+    obs_targets.reverify()
+    if desired_eye_state is not None:
+        switch_eyes(desired_eye_state)
+
+
+def create_obs_targets(obs: ObsSettings) -> list[ObsTarget]:
+    return [
+        ObsTarget(
+            target.name,
+            simpleobsws.WebSocketClient(
+                url=target.url,
+                password=target.password,
+                identification_parameters=OBS_WEBSOCKET_PARAMETERS,
+            ),
+            target.scene,
+            target.mute_inputs,
+            target.source_names,
+            on_live=engage_auto_switcher,
+            active=run_in_progress,
+            recorder=recorder,
         )
-        exit(1)
-    logging.info("Connected to OBS Websocket, identifying...")
-    await ws.wait_until_identified(timeout=10)
-    try:
-        assert ws.identified
-    except AssertionError:
-        logging.error(
-            "We were unable to identify with the OBS Websocket, please check your configuration to make sure your password matches the one the OBS Websocket plugin configuration."
+        for target in obs.targets
+    ]
+
+
+async def report_pipeline_stats_callback(timer_name, context, timer):
+    context["logger"].info(
+        f"[PIPELINE] channel: {bid_channel.stats()} consumer: {bid_consumer.stats()}"
+    )
+    rates = {
+        decision_engine.friendly_name(bid_id): round(rate, 2)
+        for bid_id, rate in bid_histories.rates().items()
+    }
+    lead_change_in = bid_histories.projected_lead_change()
+    context["logger"].info(
+        f"[HISTORY] $/s: {rates}, projected lead change in: "
+        + (f"{lead_change_in:.0f}s" if lead_change_in is not None else "never")
+    )
+
+
+async def init(bid_check_ttl: datetime.timedelta):
+    global tracker_session
+    global tracker_cache
+    global bid_client
+    global obs_targets
+    global snapshot_writer
+    obs_targets = ObsTargets(create_obs_targets(settings.obs))
+    if settings.ttl_persist_path:
+        logging.info("Checking for an active run...")
+        snapshot = load_snapshot(settings.ttl_persist_path)
+        if snapshot is not None:
+            restore_snapshot(snapshot, bid_check_ttl)
+        snapshot_writer = SnapshotWriter(settings.ttl_persist_path)
+        snapshot_writer.start(snapshot)
+    for target in obs_targets.targets:
+        target.register_event_callbacks()
+        logging.info(f"Connecting to OBS Websocket {target.name}...")
+        target.supervise(
+            probe_interval_seconds=settings.obs.ws_update_interval_seconds,
+            probe_timeout_seconds=settings.obs.probe_timeout_seconds,
+            max_reconnect_delay_seconds=settings.obs.max_reconnect_delay_seconds,
         )
-        exit(1)
-    logging.info("Identified with OBS Websocket, checking for an active run...")
-    # if (os.path.isfile(CONFIG["main"]["ttl_persist_path"])):
-    #     logging.info("Found TTL persistence file, loading...")
-    #     run_started, run started_at = await load_persistence_file(CONFIG["main"]["ttl_persist_path"])
+    if settings.tasbot.aninja_frame_function:
+        logging.info("Preparing TASBot eye frames...")
+        await asyncio.to_thread(frame_cache.prepare)
+    tracker_session = create_tracker_session(
+        pool_size=settings.event.http_pool_size,
+        keepalive_timeout_seconds=settings.event.http_keepalive_seconds,
+    )
+    if settings.event.response_cache_ttl_seconds:
+        tracker_cache = ResponseCache(settings.event.response_cache_ttl_seconds)
+    bid_client = create_bid_client(
+        settings.event.bid_client,
+        tracker_session,
+        settings.event.bid_ids,
+        settings.event.api_base_url,
+        batch_url=settings.event.batch_url,
+        timeout_seconds=settings.event.bid_request_timeout_seconds,
+        cache=tracker_cache,
+    )
     logging.info("TASBot OBS Autoswitcher initialized successfully!")
 
 
+def setup_decision_pipeline(event: EventSettings, logger=logging.getLogger()):
+    global bid_channel
+    global bid_consumer
+    global decision_engine
+    global bid_histories
+    decision_engine = DecisionEngine(
+        event.source_by_bid_id,
+        event.friendly_name_by_bid_id,
+        event.tie_source,
+        min_margin=event.decision.min_margin,
+        dwell_seconds=event.decision.dwell_seconds,
+    )
+    bid_histories = BidHistories(
+        event.bid_ids,
+        capacity=event.history.capacity,
+        rate_window_seconds=event.history.rate_window_seconds,
+    )
+    bid_channel = LatestValueChannel(maxsize=len(event.bid_ids))
+    bid_consumer = Consumer(
+        bid_channel, functools.partial(switch_to_bid_leader, logger=logger)
+    )
+    bid_consumer.start()
+
+
+async def replay(log_path: str, speed: float, logger=logging.getLogger()) -> bool:
+    """
+    Feed a recorded log's tracker responses through the decision path against a
+    stand-in for OBS, and compare the decisions with the recorded ones.
+    """
+    global clock
+    global recorder
+    global obs_targets
+    global eye_driver
+    entries: list[dict] = read_log(log_path)
+    clock = Clock(speed)
+    recorder = Recorder()
+    # Track the same bids as the recording did
+    replay_settings = settings
+    for entry in entries:
+        if entry["k"] == "start":
+            try:
+                replay_settings = compile_config(CONFIG, entry["event"], entry["env"])
+            except ConfigError as e:
+                logger.error(e)
+                return False
+            break
+    stand_ins: dict[str, StandInObs] = {
+        target.name: StandInObs.from_log(
+            entries, target.name, target.scene, replay_settings.obs.sources
+        )
+        for target in replay_settings.obs.targets
+    }
+    obs_targets = ObsTargets(
+        ObsTarget(
+            target.name,
+            stand_ins[target.name],
+            target.scene,
+            target.mute_inputs,
+            target.source_names,
+        )
+        for target in replay_settings.obs.targets
+    )
+    eye_driver = StandInEyes()
+    setup_decision_pipeline(replay_settings.event, logger)
+
+    logger.info(f"[REPLAY] Replaying {log_path} at {speed}x")
+    started = time.monotonic()
+    replayed: int = 0
+    previous_at: float = None
+    for entry in entries:
+        if entry["k"] != "tracker" or not entry["changed"]:
+            continue
+        if previous_at is not None:
+            await clock.sleep(entry["m"] - previous_at)
+        previous_at = entry["m"]
+        publish_bids(
+            {
+                bid_id: None if bid is None else Bid(**bid)
+                for bid_id, bid in entry["bids"]
+            },
+            "replay",
+        )
+        replayed += 1
+    # Let the consumer, and any switch still waiting out its dwell time, finish
+    while (
+        bid_channel.depth
+        or bid_consumer.busy
+        or (redecision_task is not None and not redecision_task.done())
+        or obs_targets.busy
+        or (eye_task is not None and not eye_task.done())
+    ):
+        await asyncio.sleep(0.001)
+    bid_consumer.cancel()
+
+    recorded_decisions = decisions(entries)
+    replayed_decisions = decisions(recorder.entries)
+    logger.info(
+        f"[REPLAY] Replayed {replayed} tracker updates in {time.monotonic() - started:.2f}s, "
+        + ", ".join(
+            f"{name}: {stand_in.requests} OBS requests, {stand_in.top_source} on air"
+            for name, stand_in in stand_ins.items()
+        )
+    )
+    if replayed_decisions != recorded_decisions:
+        logger.warning(
+            f"[REPLAY] Decisions differ from the recording: recorded {recorded_decisions}, replayed {replayed_decisions}"
+        )
+        return False
+    logger.info(f"[REPLAY] Decisions match the recording: {replayed_decisions}")
+    return True
+
+
+def parse_args(argv: list[str] = None) -> "argparse.Namespace":
+    # Only needed once at startup, so it isn't imported with everything else
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Automated video switcher for OBS based on external conditions."
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--record",
+        metavar="LOG",
+        help="append every tracker response, OBS request/response and switching decision to LOG",
+    )
+    mode.add_argument(
+        "--replay",
+        metavar="LOG",
+        help="replay a recorded LOG against a stand-in for OBS instead of running live",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILES,
+        help="runtime profile, overriding main.runtime.profile in config.py",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=100.0,
+        help="how many times faster than real time to replay (default: 100)",
+    )
+    return parser.parse_args(argv)
+
+
+async def start_metrics(runtime: Runtime, logger=logging.getLogger()):
+    global metrics_server
+    global loop_lag_monitor
+    metrics_settings = settings.metrics
+    # asyncio's debug mode already names slow callbacks in the dev profile
+    loop_lag_monitor = EventLoopLagMonitor(
+        metrics_settings.loop_lag_interval_seconds,
+        slow_callback_seconds=None if runtime.debug else runtime.slow_callback_seconds,
+        logger=logger,
+    )
+    loop_lag_monitor.start()
+    if not metrics_settings.port:
+        return
+    metrics_server = MetricsServer(metrics_settings.host, metrics_settings.port, logger)
+    try:
+        await metrics_server.start()
+    except OSError as e:
+        logger.error(f"[METRICS] Unable to serve metrics: {e}")
+        metrics_server = None
+
+
 def main():
+    global settings
+    global bid_stream
+    global recorder
     logger = logging.getLogger()
+    args = parse_args()
     try:
-        event: str = CONFIG["main"]["event"]
-        event_env: str = CONFIG["main"]["env"]
-        loop = asyncio.get_event_loop()
-        loop.set_debug(enabled=True)
-        loop.run_until_complete(init())
-        ws.register_event_callback(on_switchedscenes, "CurrentProgramSceneChanged")
+        settings = compile_config(CONFIG)
+    except ConfigError as e:
+        logger.error(e)
+        exit(1)
+    runtime = Runtime(
+        args.profile or settings.runtime.profile,
+        use_uvloop=settings.runtime.uvloop,
+        slow_callback_seconds=settings.runtime.slow_callback_seconds,
+        logger=logger,
+    )
+    runtime.start_logging()
+    if args.replay:
+        exit(0 if asyncio.run(replay(args.replay, args.speed, logger)) else 1)
+    event: EventSettings = settings.event
+    if args.record:
+        recorder = Recorder(args.record)
+        recorder.record("start", event=event.name, env=event.env)
+        logger.info(f"Recording to {args.record}")
+    create_clients()
+    try:
+        loop = runtime.new_event_loop()
+        # The snapshot is restored into the decision pipeline, so it comes first
+        setup_decision_pipeline(event, logger)
+        loop.run_until_complete(init(event.bid_check_ttl))
+        loop.run_until_complete(start_metrics(runtime, logger))
         timers: list = []
-        polling_interval: int = CONFIG["events"][event]["poll_interval_seconds"]
-        obsws_update_interval: int = (
-            CONFIG["obs"]["ws_update_interval_seconds"]
-            if CONFIG["obs"]["ws_update_interval_seconds"]
+        polling_interval: float = event.poll_interval_seconds
+        adaptive_polling = event.adaptive_polling
+        adaptive_poll_interval: AdaptivePollInterval = (
+            AdaptivePollInterval(
+                min_interval_seconds=adaptive_polling.min_interval_seconds,
+                max_interval_seconds=adaptive_polling.max_interval_seconds,
+                close_margin=adaptive_polling.close_margin,
+                comfortable_margin=adaptive_polling.comfortable_margin,
+                max_error_backoff_seconds=adaptive_polling.max_error_backoff_seconds,
+            )
+            if adaptive_polling is not None
             else None
         )
-        logger = logging.getLogger()
+        autoswitcher_context: dict = {
+            "logger": logger,
+            "bid_check_ttl": event.bid_check_ttl,
+            "adaptive_poll_interval": adaptive_poll_interval,
+        }
+        if event.stream_url:
+            bid_stream = BidStream(
+                tracker_session,
+                event.stream_url,
+                bid_client,
+                functools.partial(on_stream_bids, autoswitcher_context),
+                logger=logger,
+            )
+            bid_stream.start()
         timers.append(
             {
                 "timer": Timer(
-                    interval=1,
+                    interval=polling_interval,
                     first_immediately=True,
                     timer_name="tasbot_obs_autoswitcher",
-                    context={
-                        "logger": logger,
-                        "bids_to_track": CONFIG["events"][event][event_env][
-                            "bids_to_track"
-                        ],
-                        "base_url": CONFIG["events"][event][event_env]["api_base_url"],
-                        "bid_check_ttl": CONFIG["events"][event]["bid_check_ttl"],
-                    },
+                    context=autoswitcher_context,
                     callback=tasbot_obs_autoswitcher_callback_v2,
                 ),
-                "interval": 1,
+                "interval": polling_interval,
+            }
+        )
+        timers.append(
+            {
+                "timer": Timer(
+                    interval=settings.obs.reverify_interval_seconds,
+                    first_immediately=False,
+                    timer_name="reverify_on_air_state",
+                    context={"logger": logger, "bid_check_ttl": event.bid_check_ttl},
+                    callback=reverify_on_air_state_callback,
+                ),
+                "interval": settings.obs.reverify_interval_seconds,
+            }
+        )
+        timers.append(
+            {
+                "timer": Timer(
+                    interval=settings.stats_interval_seconds,
+                    first_immediately=False,
+                    timer_name="report_pipeline_stats",
+                    context={"logger": logger},
+                    callback=report_pipeline_stats_callback,
+                ),
+                "interval": settings.stats_interval_seconds,
             }
         )
         loop.run_forever()
     except KeyboardInterrupt:
         logger.warning("KeyboardInterrupt received, cleaning up...")
-        loop.run_until_complete(ws.disconnect())
+        if obs_targets is not None:
+            loop.run_until_complete(obs_targets.close())
+        loop.run_until_complete(eye_driver.close())
+        if bid_stream is not None:
+            loop.run_until_complete(bid_stream.close())
+        if bid_consumer is not None:
+            bid_consumer.cancel()
+        if recorder is not None:
+            recorder.close()
+        if redecision_task is not None:
+            redecision_task.cancel()
+        if eye_task is not None:
+            eye_task.cancel()
+        if snapshot_writer is not None:
+            loop.run_until_complete(snapshot_writer.close())
+        if loop_lag_monitor is not None:
+            loop_lag_monitor.cancel()
+        if metrics_server is not None:
+            loop.run_until_complete(metrics_server.close())
+        if tracker_session is not None:
+            loop.run_until_complete(tracker_session.close())
         for timer in timers:
             try:
                 timer["timer"].cancel()
@@ -395,6 +778,7 @@ def main():
                 pass
         loop.close()
         logger.warning("Exited.")
+        runtime.stop_logging()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+"""
+In-process metrics.
+
+Counters and fixed-bucket histograms, cheap enough to leave on during the live
+broadcast: recording a value is a dict lookup, a bisect and a few additions, with
+no locks or background work. Everything is exposed in the Prometheus text format
+from a small HTTP endpoint, alongside an event loop lag monitor.
+"""
+import asyncio
+import bisect
+import logging
+import time
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape_label_value(value) -> str:
+    # As the text exposition format requires
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    labels = [
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+        if value is not None
+    ]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+            )
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: dict[tuple, _HistogramSeries] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = _HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return series.count if series is not None else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series.counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series.sum}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+TRACKER_REQUEST_SECONDS = Histogram(
+    "tasbot_tracker_request_seconds",
+    "Time taken by tracker requests, per bid (or batch)",
+    ("bid",),
+)
+TRACKER_ERRORS = Counter(
+    "tasbot_tracker_errors_total", "Failed tracker requests and updates", ("kind",)
+)
+OBS_REQUEST_SECONDS = Histogram(
+    "tasbot_obs_request_seconds",
+    "Round trip time of obs-websocket requests, per OBS target and request type",
+    ("target", "request_type"),
+)
+DECISION_TO_AIR_SECONDS = Histogram(
+    "tasbot_decision_to_air_seconds",
+    "Time from a bid change being detected to the new leader being on air, per OBS target",
+    ("target",),
+)
+TIMER_LAG_SECONDS = Histogram(
+    "tasbot_timer_lag_seconds",
+    "How late each timer tick started",
+    ("timer",),
+)
+TIMER_OVERRUNS = Counter(
+    "tasbot_timer_overruns_total",
+    "Timer callbacks that ran past their next tick",
+    ("timer",),
+)
+TIMER_SKIPPED_TICKS = Counter(
+    "tasbot_timer_skipped_ticks_total",
+    "Timer ticks skipped because a callback overran them",
+    ("timer",),
+)
+TIMER_ERRORS = Counter(
+    "tasbot_timer_errors_total", "Timer callbacks that raised", ("timer",)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "tasbot_event_loop_lag_seconds", "How late the event loop ran a scheduled callback"
+)
+SWITCHES = Counter(
+    "tasbot_switches_total", "Sources put on air by the autoswitcher", ("source",)
+)
+EYE_CHANGES = Counter("tasbot_eye_changes_total", "TASBot eye changes", ("eye",))
+RECONNECTS = Counter(
+    "tasbot_reconnects_total",
+    "Reconnects of long-lived connections, such as the bid stream",
+    ("connection",),
+)
+
+REGISTRY = (
+    TRACKER_REQUEST_SECONDS,
+    TRACKER_ERRORS,
+    OBS_REQUEST_SECONDS,
+    DECISION_TO_AIR_SECONDS,
+    TIMER_LAG_SECONDS,
+    TIMER_OVERRUNS,
+    TIMER_SKIPPED_TICKS,
+    TIMER_ERRORS,
+    EVENT_LOOP_LAG_SECONDS,
+    SWITCHES,
+    EYE_CHANGES,
+    RECONNECTS,
+)
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class TimedWebSocketClient:
+    """Wraps a simpleobsws client, timing every request it sends to the named target."""
+
+    def __init__(self, ws, target: str):
+        self._ws = ws
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    async def call(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._ws.call(request, *args, **kwargs)
+        finally:
+            OBS_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, self._target, request.requestType
+            )
+
+    async def call_batch(self, requests, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._ws.call_batch(requests, *args, **kwargs)
+        finally:
+            OBS_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, self._target, "RequestBatch"
+            )
+
+
+class EventLoopLagMonitor:
+    def __init__(
+        self,
+        interval_seconds: float = 0.5,
+        slow_callback_seconds: float = None,
+        logger=logging.getLogger(),
+    ):
+        """
+        With slow_callback_seconds, also warn whenever something kept the loop from
+        running for longer than that, e.g. a blocking call in a callback.
+        """
+        self._interval_seconds = interval_seconds
+        self._slow_callback_seconds = slow_callback_seconds
+        self._logger = logger
+        self._task: asyncio.Task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            scheduled = time.monotonic() + self._interval_seconds
+            await asyncio.sleep(self._interval_seconds)
+            lag = max(time.monotonic() - scheduled, 0.0)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if (
+                self._slow_callback_seconds is not None
+                and lag > self._slow_callback_seconds
+            ):
+                self._logger.warning(
+                    "[LOOP] Event loop was blocked for %.0fms", lag * 1000
+                )
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int, logger=logging.getLogger()):
+        self._host = host
+        self._port = port
+        self._logger = logger
+        self._runner = None
+
+    async def start(self):
+        # Only imported when metrics are served, it's the slowest import here
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        self._logger.info(
+            f"[METRICS] Serving metrics at http://{self._host}:{self._port}/metrics"
+        )
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
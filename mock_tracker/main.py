@@ -1,91 +1,335 @@
-from flask import Flask, request, jsonify, render_template
-import logging
+import argparse
+import asyncio
+import datetime
 import json
+import logging
+import os
+import time
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+
+import jinja2
+from aiohttp import web
 
-app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
+DB_DIR = Path('./db')
+SNAPSHOT_DELAY_SECONDS = 1.0
+
+
+class BidStore:
+    # Every bid from every ./db/*.json tracker response, held in memory and written
+    # back behind the requests that change it, at most once every SNAPSHOT_DELAY_SECONDS
+    def __init__(self, db_dir: Path):
+        self.db_dir = db_dir
+        self.bids: dict[int, dict] = {}
+        self.files: dict[Path, list[int]] = {}
+        self.aliases: dict[str, int] = {}
+        self.version = 0
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        # Stream subscribers, each with the function that renders the events it's sent
+        self.subscribers: dict[asyncio.Queue, callable] = {}
+        self.streams_closed = False
+        self._responses: dict[str, tuple[bytes, str]] = {}
+        self._dirty = asyncio.Event()
+        self._snapshot_task: asyncio.Task = None
+
+    def load(self):
+        for path in sorted(self.db_dir.glob('*.json')):
+            with open(path, 'r') as f:
+                results = json.load(f)['results']
+            self.files[path] = [bid['id'] for bid in results]
+            for bid in results:
+                self.bids[bid['id']] = bid
+            # A file holding a single bid is also served at /<file name>, e.g. /kill
+            if len(results) == 1:
+                self.aliases[path.stem] = results[0]['id']
+        logger.info(f"Loaded {len(self.bids)} bids from {len(self.files)} files")
+
+    def label(self, bid_id: int) -> str:
+        for alias, aliased_bid_id in self.aliases.items():
+            if aliased_bid_id == bid_id:
+                return alias.title()
+        return self.bids[bid_id]['shortdescription']
+
+    def bid_wars(self) -> list[list[dict]]:
+        # The options of each bid war, grouped by their parent bid
+        bid_wars: dict[int, list[dict]] = {}
+        for bid in self.bids.values():
+            bid_wars.setdefault(bid['parent'], []).append(bid)
+        return list(bid_wars.values())
+
+    def siblings(self, bid_id: int) -> list[dict]:
+        parent = self.bids[bid_id]['parent']
+        return [bid for bid in self.bids.values() if bid['parent'] == parent and bid['id'] != bid_id]
+
+    def is_ahead(self, bid_id: int) -> bool:
+        total = float(self.bids[bid_id]['total'])
+        return total >= 1 and all(total > float(bid['total']) for bid in self.siblings(bid_id))
+
+    def search(self, parameters) -> list[dict]:
+        # Mirrors the GDQ tracker's bid search: look up by id, or batch by parent bid / event
+        results = list(self.bids.values())
+        if 'id' in parameters:
+            ids = parameters['id'].split(',')
+            results = [bid for bid in results if str(bid['id']) in ids]
+        if 'parent' in parameters:
+            results = [bid for bid in results if str(bid['parent']) == parameters['parent']]
+        if 'event' in parameters:
+            results = [bid for bid in results if str(bid['event']) == parameters['event']]
+        return results
+
+    def cached_response(self, key: str, build) -> tuple[bytes, str]:
+        # Serialized responses are reused until the next change, so reads cost no JSON encoding
+        if key not in self._responses:
+            self._responses[key] = (json.dumps(build()).encode(), f'W/"{self.version}"')
+        return self._responses[key]
+
+    def lead(self, bid_id: int):
+        # Put bid_id ahead of the other options of its bid war
+        self.bids[bid_id]['total'] = '1'
+        for bid in self.siblings(bid_id):
+            bid['total'] = '0'
+        self.changed()
+
+    def donate(self, bid_id: int, amount: float):
+        self.bids[bid_id]['total'] = str(float(self.bids[bid_id]['total']) + amount)
+        self.bids[bid_id]['count'] = self.bids[bid_id].get('count', 0) + 1
+        self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self._responses.clear()
+        self._dirty.set()
+        self.publish()
+
+    def event(self) -> str:
+        results = list(self.bids.values())
+        payload = {'count': len(results), 'next': None, 'previous': None, 'results': results, 'published_at': time.time()}
+        return f"event: bids\ndata: {json.dumps(payload)}\n\n"
+
+    def publish(self):
+        # Push the new totals to every stream subscriber, dropping anything they haven't read yet
+        if self.streams_closed:
+            return
+        events: dict = {}
+        for subscriber, render in self.subscribers.items():
+            if render not in events:
+                events[render] = render()
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(events[render])
+
+    def close_streams(self):
+        # Wake every stream handler with None so it returns now, rather than at its next keepalive
+        self.streams_closed = True
+        for subscriber in self.subscribers:
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(None)
+
+    def start(self):
+        self._snapshot_task = asyncio.create_task(self._write_behind())
+
+    async def close(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        if self._dirty.is_set():
+            self.snapshot()
+
+    async def _write_behind(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(SNAPSHOT_DELAY_SECONDS)
+            self._dirty.clear()
+            try:
+                await asyncio.to_thread(self.snapshot)
+            except OSError as e:
+                logger.error(f"Unable to write a snapshot: {e}")
+                self._dirty.set()
+
+    def snapshot(self):
+        for path, bid_ids in self.files.items():
+            results = [self.bids[bid_id] for bid_id in bid_ids]
+            payload = {'count': len(results), 'next': None, 'previous': None, 'results': results}
+            tmp_path = path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f, indent=4)
+            os.replace(tmp_path, path)
+
+
+def not_modified(request: web.Request, etag: str) -> bool:
+    if 'If-None-Match' in request.headers:
+        return etag in [tag.strip() for tag in request.headers['If-None-Match'].split(',')]
+    if 'If-Modified-Since' in request.headers:
+        try:
+            return store.last_modified <= parsedate_to_datetime(request.headers['If-Modified-Since'])
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_json(request: web.Request, key: str, build) -> web.Response:
+    # Emit validators so clients can send If-None-Match / If-Modified-Since and get a 304
+    body, etag = store.cached_response(key, build)
+    headers = {'ETag': etag, 'Last-Modified': format_datetime(store.last_modified, usegmt=True)}
+    if not_modified(request, etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+
+def tracker_response(results: list[dict]) -> dict:
+    return {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+
+def get_bid_id(request: web.Request) -> int:
+    try:
+        bid_id = int(request.match_info['bid_id'])
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid bid ID')
+    if bid_id not in store.bids:
+        raise web.HTTPNotFound(text=f"No bid with ID {bid_id}")
+    return bid_id
+
+
+store = BidStore(DB_DIR)
+templates = jinja2.Environment(loader=jinja2.FileSystemLoader('templates'), autoescape=True)
+templates.globals['url_for'] = lambda endpoint, filename: f"/{endpoint}/{filename}"
+routes = web.RouteTableDef()
+
+
+def template_context() -> dict:
+    return {
+        'bids': list(store.bids.values()),
+        'bid_wars': store.bid_wars(),
+        'labels': {bid_id: store.label(bid_id) for bid_id in store.bids},
+        'ahead': {bid_id: store.is_ahead(bid_id) for bid_id in store.bids},
+    }
+
+
+def status_event() -> str:
+    status = templates.get_template('status.html').render(template_context())
+    return 'event: status\n' + ''.join(f"data: {line}\n" for line in status.splitlines()) + '\n'
+
+
+@routes.get('/')
+async def index(request: web.Request):
+    # serve the file at ./templates/controller.html
+    return web.Response(text=templates.get_template('controller.html').render(template_context()), content_type='text/html')
+
+
+@routes.get('/tracker/api/v2/bids/')
+async def bids(request: web.Request):
+    return conditional_json(request, request.path_qs, lambda: tracker_response(store.search(request.query)))
+
+
+async def event_stream(request: web.Request, render) -> web.StreamResponse:
+    # Server-Sent Events: render() on connect, then again every time a bid changes
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    subscriber = asyncio.Queue(maxsize=1)
+    store.subscribers[subscriber] = render
+    try:
+        await response.write(render().encode())
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), timeout=15)
+            except asyncio.TimeoutError:
+                event = ": keepalive\n\n"
+            if event is None:
+                break
+            await response.write(event.encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        del store.subscribers[subscriber]
+    return response
+
+
+@routes.get('/tracker/api/v2/bids/stream')
+async def bids_stream(request: web.Request):
+    return await event_stream(request, store.event)
+
+
+@routes.get('/status/stream')
+async def status_stream(request: web.Request):
+    # The controller's status panel, pushed to the page by htmx's hx-sse
+    return await event_stream(request, status_event)
+
+
+@routes.post('/tracker/api/v2/bids/{bid_id}/lead')
+async def lead(request: web.Request):
+    bid_id = get_bid_id(request)
+    store.lead(bid_id)
+    return web.json_response(tracker_response([store.bids[bid_id]]))
+
+
+@routes.post('/tracker/api/v2/bids/{bid_id}/donate')
+async def donate(request: web.Request):
+    bid_id = get_bid_id(request)
+    try:
+        amount = float(request.query.get('amount', '1'))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid amount')
+    store.donate(bid_id, amount)
+    return web.json_response(tracker_response([store.bids[bid_id]]))
+
+
+@routes.get('/{alias}')
+async def alias(request: web.Request):
+    if request.match_info['alias'] not in store.aliases:
+        raise web.HTTPNotFound()
+    bid_id = store.aliases[request.match_info['alias']]
+    if 'status' in request.query:
+        if store.is_ahead(bid_id):
+            return web.Response(text="<div class='ahead'>✅</div>", content_type='text/html')
+        return web.Response(text="<div class='behind'>❌</div>", content_type='text/html')
+    return conditional_json(request, request.path, lambda: tracker_response([store.bids[bid_id]]))
+
+
+@routes.post('/{alias}')
+async def set_alias_as_lead(request: web.Request):
+    if request.match_info['alias'] not in store.aliases:
+        raise web.HTTPNotFound()
+    bid_id = store.aliases[request.match_info['alias']]
+    store.lead(bid_id)
+    return web.json_response(tracker_response([store.bids[bid_id]]))
+
+
+async def on_startup(app: web.Application):
+    store.start()
+
+
+async def on_shutdown(app: web.Application):
+    store.close_streams()
+
+
+async def on_cleanup(app: web.Application):
+    await store.close()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.add_routes(routes)
+    app.router.add_static('/static', 'static')
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+    return app
 
-# Read from ./db/kill.json and ./db/save.json on init
-kill_json = None
-save_json = None
-
-try:
-    with open('./db/kill.json', 'r') as f:
-        kill_json = json.load(f)
-except OSError as e:
-    logger.error(f"Unable to read kill.json: {e}")
-    exit(1)
-
-try:
-    with open('./db/save.json', 'r') as f:
-        save_json = json.load(f)
-except OSError as e:
-    logger.error(f"Unable to read save.json: {e}")
-    exit(1)
-
-
-def update_kill_save(mode, kill_json, save_json):
-    if mode == 'kill':
-        kill_json['results'][0]['total'] = '1'
-        save_json['results'][0]['total'] = '0'
-    elif mode == 'save':
-        kill_json['results'][0]['total'] = '0'
-        save_json['results'][0]['total'] = '1'
-    else:
-        raise ValueError(f"Invalid mode: {mode}")
-    with open('./db/kill.json', 'w') as f:
-        json.dump(kill_json, f)
-    with open('./db/save.json', 'w') as f:
-        json.dump(save_json, f)
-    return kill_json, save_json
-
-@app.route('/')
-def index():
-    # serve the file at ./html/controller.html
-    return render_template('controller.html')
-
-
-@app.route('/kill', methods=['GET'])
-def kill():
-    parameters = request.args
-    global kill_json
-    if request.method == 'GET':
-        if 'status' in parameters:
-            if int(float(kill_json['results'][0]['total'])) >= 1 and float(kill_json['results'][0]['total']) > float(save_json['results'][0]['total']):
-                return "<div class='ahead'>✅</div>"
-            else:
-                return "<div class='behind'>❌</div>"
-        return jsonify(kill_json)
-
-@app.route('/kill', methods=['POST'])
-def set_kill_as_lead():
-    # logger.info(f"POST /kill")
-    global kill_json
-    global save_json
-    kill_json, save_json = update_kill_save('kill', kill_json, save_json)
-
-    return jsonify(kill_json)
-
-@app.route('/save', methods=['GET'])
-def save():
-    parameters = request.args
-    global save_json
-    if request.method == 'GET':
-        if 'status' in parameters:
-            if int(float(save_json['results'][0]['total'])) >= 1 and float(save_json['results'][0]['total']) > float(kill_json['results'][0]['total']):
-                return "<div class='ahead'>✅</div>"
-            else:
-                return "<div class='behind'>❌</div>"
-        return jsonify(save_json)
-
-@app.route('/save', methods=['POST'])
-def update_save():
-    # logger.info(f"POST /save")
-    global kill_json
-    global save_json
-    kill_json, save_json = update_kill_save('save', kill_json, save_json)
-    return jsonify(save_json)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Mock GDQ donation tracker for the TASBot OBS Autoswitcher.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        store.load()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Unable to load the bids in {DB_DIR}: {e}")
+        exit(1)
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=logger if args.access_log else None)
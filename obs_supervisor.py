@@ -0,0 +1,120 @@
+"""
+Keeps an OBS target's obs-websocket connection up.
+
+Connects and identifies in the background, probes the connection every
+probe_interval_seconds, and reconnects with backoff whenever it drops or stops
+answering. Event callbacks stay registered on the client across reconnects, and
+on_connected runs after every (re)connect so scene items and mutes can be read
+from OBS again. Nothing is queued while OBS is unreachable: callers check
+`connected` and only keep their latest desired state, which on_connected applies
+in one go.
+"""
+import asyncio
+import logging
+
+import simpleobsws
+
+from metrics import RECONNECTS, TimedWebSocketClient
+
+
+class ObsSupervisor:
+    def __init__(
+        self,
+        name: str,
+        ws: simpleobsws.WebSocketClient,
+        on_connected,
+        probe_interval_seconds: float = 1.0,
+        probe_timeout_seconds: float = 5.0,
+        identify_timeout_seconds: float = 10.0,
+        max_reconnect_delay_seconds: float = 30.0,
+        logger=logging.getLogger(),
+    ):
+        """on_connected is an async callable run after every (re)connect."""
+        self.name = name
+        self._ws = ws
+        self._probe_client = TimedWebSocketClient(ws, name)
+        self._on_connected = on_connected
+        self._probe_interval_seconds = probe_interval_seconds
+        self._probe_timeout_seconds = probe_timeout_seconds
+        self._identify_timeout_seconds = identify_timeout_seconds
+        self._max_reconnect_delay_seconds = max_reconnect_delay_seconds
+        self._logger = logger
+        self._task: asyncio.Task = None
+        self._connected: bool = False
+        self.reconnects: int = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._connected and self._ws.identified
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._connected = False
+        await self._ws.disconnect()
+
+    async def _run(self):
+        reconnect_delay = 0.5
+        while True:
+            try:
+                await self._connect()
+                reconnect_delay = 0.5
+                self._connected = True
+                await self._on_connected()
+                await self._probe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.error(
+                    f"[OBS] {self.name}: Unable to talk to OBS Websocket: {e!r}"
+                )
+            self._connected = False
+            try:
+                await self._ws.disconnect()
+            except Exception:
+                pass
+            self._logger.warning(
+                f"[OBS] {self.name}: Holding switches until OBS is back, reconnecting in {reconnect_delay}s"
+            )
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(
+                reconnect_delay * 2, self._max_reconnect_delay_seconds
+            )
+            self.reconnects += 1
+            RECONNECTS.inc(f"obs_{self.name}")
+
+    async def _connect(self):
+        await self._ws.connect()
+        self._logger.info(
+            f"[OBS] {self.name}: Connected to OBS Websocket, identifying..."
+        )
+        if not await self._ws.wait_until_identified(
+            timeout=self._identify_timeout_seconds
+        ):
+            raise ConnectionError(
+                "Unable to identify with the OBS Websocket, make sure the password matches the one in the OBS Websocket plugin configuration"
+            )
+        self._logger.info(f"[OBS] {self.name}: Identified with OBS Websocket")
+
+    async def _probe(self):
+        """Return once the connection has dropped, raise once it stops answering."""
+        while True:
+            await asyncio.sleep(self._probe_interval_seconds)
+            if not self._ws.identified:
+                self._logger.warning(
+                    f"[OBS] {self.name}: OBS Websocket connection closed"
+                )
+                return
+            response = await self._probe_client.call(
+                simpleobsws.Request("GetVersion"),
+                timeout=self._probe_timeout_seconds,
+            )
+            if not response.ok():
+                raise ConnectionError(
+                    f"GetVersion failed with code {response.requestStatus.code}"
+                )
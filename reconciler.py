@@ -0,0 +1,198 @@
+"""
+Desired-state reconciler for what is on air.
+
+The switcher only says what it wants on air (top source and muted inputs). Each
+OBS target has its own reconciler, which remembers what it last applied there
+and sends that OBS only the commands needed to close the gap, so a steady winner
+costs nothing.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from functools import partial
+
+import simpleobsws
+
+from scene_cache import SceneItemCache
+
+
+@dataclass(frozen=True)
+class OnAirState:
+    top_source: str
+    muted_inputs: frozenset
+
+
+class Reconciler:
+    def __init__(
+        self,
+        name: str,
+        ws: simpleobsws.WebSocketClient,
+        scene_item_cache: SceneItemCache,
+        scene_name: str,
+        mute_inputs: dict[str, str],
+        source_names: dict[str, str] = None,
+        logger=logging.getLogger(),
+    ):
+        """
+        mute_inputs maps each source to the audio input that should only be unmuted
+        while that source is on top. source_names maps a source to the name of its
+        scene item in scene_name, where that differs.
+        """
+        self.name = name
+        self._ws = ws
+        self._scene_item_cache = scene_item_cache
+        self._scene_name = scene_name
+        self._mute_inputs = mute_inputs
+        self._source_names = source_names or {}
+        self._input_names: tuple[str, ...] = tuple(mute_inputs.values())
+        # Everything a switch needs is built once here rather than on every switch
+        self._mute_request_data: dict[tuple[str, bool], dict] = {
+            (input_name, input_muted): {
+                "inputName": input_name,
+                "inputMuted": input_muted,
+            }
+            for input_name in self._input_names
+            for input_muted in (True, False)
+        }
+        self._states: dict[str, OnAirState] = {
+            source: self._build_state(source) for source in mute_inputs
+        }
+        self._logger = logger
+        self._lock = asyncio.Lock()
+        self.desired: OnAirState = None
+        self.applied_mutes: dict[str, bool] = {}
+
+    def register_event_callbacks(self):
+        self._ws.register_event_callback(
+            self.on_input_mute_state_changed, "InputMuteStateChanged"
+        )
+
+    def state_for(self, source: str) -> OnAirState:
+        state = self._states.get(source)
+        if state is None:
+            state = self._states[source] = self._build_state(source)
+        return state
+
+    def _build_state(self, source: str) -> OnAirState:
+        return OnAirState(
+            top_source=source,
+            muted_inputs=frozenset(
+                input_name
+                for input_source, input_name in self._mute_inputs.items()
+                if input_source != source
+            ),
+        )
+
+    async def set_desired(self, desired: OnAirState):
+        self.desired = desired
+        await self.reconcile()
+
+    async def reconcile(self):
+        async with self._lock:
+            await self._reconcile()
+
+    async def _reconcile(self):
+        desired = self.desired
+        if desired is None:
+            return
+        requests: list[simpleobsws.Request] = []
+        on_success: list = []
+
+        source_name = self._source_names.get(desired.top_source, desired.top_source)
+        scene_item = await self._scene_item_cache.lookup(self._scene_name, source_name)
+        if scene_item is None:
+            self._logger.error(
+                f"[SWITCHER] {self.name}: Could not find sceneItemIndex with name {source_name} in {self._scene_name}"
+            )
+        else:
+            scene_item_id, scene_item_index, top_scene_item_index = scene_item
+            if scene_item_index != top_scene_item_index:
+                requests.append(
+                    simpleobsws.Request(
+                        "SetSceneItemIndex",
+                        {
+                            "sceneName": self._scene_name,
+                            "sceneItemId": scene_item_id,
+                            "sceneItemIndex": top_scene_item_index,
+                        },
+                    )
+                )
+                on_success.append(
+                    partial(
+                        self._scene_item_cache.moved,
+                        self._scene_name,
+                        scene_item_id,
+                        top_scene_item_index,
+                    )
+                )
+
+        for input_name in self._input_names:
+            input_muted = input_name in desired.muted_inputs
+            if self.applied_mutes.get(input_name) != input_muted:
+                requests.append(
+                    simpleobsws.Request(
+                        "SetInputMute",
+                        self._mute_request_data[(input_name, input_muted)],
+                    )
+                )
+                on_success.append(
+                    partial(self.applied_mutes.__setitem__, input_name, input_muted)
+                )
+
+        if not requests:
+            self._logger.debug(
+                "[SWITCHER] %s: %s is already on air", self.name, desired.top_source
+            )
+            return
+        self._logger.info(
+            f"[SWITCHER] {self.name}: Putting {desired.top_source} on air with {len(requests)} request(s)"
+        )
+        # Send the reorder and the mutes as one batch so audio and video change together
+        responses: list[simpleobsws.RequestResponse] = await self._ws.call_batch(
+            requests,
+            halt_on_failure=False,
+            execution_type=simpleobsws.RequestBatchExecutionType.SerialRealtime,
+        )
+        for response, apply in zip(responses, on_success):
+            if response.ok():
+                apply()
+            else:
+                self._logger.error(
+                    f"[SWITCHER] {self.name}: {response.requestType} failed with code {response.requestStatus.code}: {response.requestStatus.comment}"
+                )
+
+    async def reverify(self):
+        """
+        Re-read what OBS actually has on air and correct anything that drifted, e.g.
+        an operator reordering sources or toggling a mute by hand.
+        """
+        if self.desired is None:
+            return
+        await self.resync()
+
+    async def resync(self, apply: bool = True):
+        """
+        Re-read the scene order and input mutes from OBS, then apply the desired
+        state unless apply is False, e.g. after reconnecting. Switches wait until
+        it's done, so none of them run against a stale scene index.
+        """
+        async with self._lock:
+            await self._scene_item_cache.refresh(self._scene_name)
+            responses: list[simpleobsws.RequestResponse] = await self._ws.call_batch(
+                [
+                    simpleobsws.Request("GetInputMute", {"inputName": input_name})
+                    for input_name in self._input_names
+                ],
+                halt_on_failure=False,
+            )
+            for input_name, response in zip(self._input_names, responses):
+                if response.ok():
+                    self.applied_mutes[input_name] = response.responseData["inputMuted"]
+                else:
+                    self.applied_mutes.pop(input_name, None)
+            if apply:
+                await self._reconcile()
+
+    async def on_input_mute_state_changed(self, eventData):
+        if eventData["inputName"] in self._input_names:
+            self.applied_mutes[eventData["inputName"]] = eventData["inputMuted"]
@@ -0,0 +1,223 @@
+"""
+Record and replay.
+
+In recording mode every tracker response, every OBS request/response and every
+switching decision is appended to a JSON lines log, one compact object per line:
+
+    {"t": <unix time>, "m": <seconds since recording started>, "k": <kind>, ...}
+
+Replay mode feeds the recorded tracker responses back through the decision path,
+optionally faster than real time, against a stand-in for OBS, and compares the
+decisions it makes with the recorded ones.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import simpleobsws
+
+
+class Clock:
+    """Monotonic time that can run faster than real time, for replays."""
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self._started = time.monotonic()
+
+    def now(self) -> float:
+        return self._started + (time.monotonic() - self._started) * self.speed
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds / self.speed)
+
+
+class Recorder:
+    def __init__(self, path: str = None):
+        """With no path, entries are kept in memory in `entries` instead."""
+        self._started = time.monotonic()
+        self._file = open(path, "a", buffering=1) if path else None
+        self.entries: list[dict] = []
+
+    def record(self, kind: str, **fields):
+        entry = {
+            "t": round(time.time(), 6),
+            "m": round(time.monotonic() - self._started, 6),
+            "k": kind,
+            **fields,
+        }
+        if self._file is None:
+            self.entries.append(entry)
+        else:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_log(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _request_entry(request: simpleobsws.Request) -> dict:
+    return {"type": request.requestType, "data": request.requestData}
+
+
+def _response_entry(response: simpleobsws.RequestResponse) -> dict:
+    return {
+        "type": response.requestType,
+        "ok": response.ok(),
+        "code": response.requestStatus.code,
+        "comment": response.requestStatus.comment,
+        "data": response.responseData,
+    }
+
+
+class RecordingWebSocketClient:
+    """
+    Wraps a simpleobsws client, recording every request it sends to the named
+    target and the response.
+    """
+
+    def __init__(
+        self, ws: simpleobsws.WebSocketClient, recorder: Recorder, target: str
+    ):
+        self._ws = ws
+        self._recorder = recorder
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    async def call(self, request: simpleobsws.Request, *args, **kwargs):
+        response = await self._ws.call(request, *args, **kwargs)
+        self._recorder.record(
+            "obs",
+            target=self._target,
+            requests=[_request_entry(request)],
+            responses=[_response_entry(response)],
+        )
+        return response
+
+    async def call_batch(self, requests: list[simpleobsws.Request], *args, **kwargs):
+        responses = await self._ws.call_batch(requests, *args, **kwargs)
+        self._recorder.record(
+            "obs",
+            target=self._target,
+            requests=[_request_entry(request) for request in requests],
+            responses=[_response_entry(response) for response in responses],
+        )
+        return responses
+
+
+class StandInObs:
+    """
+    Just enough of OBS for the reconciler and scene item cache: one scene whose
+    items can be reordered, and input mutes.
+    """
+
+    def __init__(
+        self, scene_name: str, source_names: list[str], logger=logging.getLogger()
+    ):
+        """source_names are the scene's items, bottom to top."""
+        self._scene_name = scene_name
+        self._source_names = list(source_names)
+        self._order = list(range(len(self._source_names)))
+        self._logger = logger
+        self.mutes: dict[str, bool] = {}
+        self.requests: int = 0
+
+    @classmethod
+    def from_log(
+        cls, entries: list[dict], target: str, scene_name: str, fallback_sources
+    ):
+        """
+        Use the first scene item list recorded for target's scene_name, if there is
+        one.
+        """
+        for entry in entries:
+            if entry["k"] != "obs" or entry["target"] != target:
+                continue
+            for request, response in zip(entry["requests"], entry["responses"]):
+                if (
+                    request["type"] == "GetSceneItemList"
+                    and request["data"]["sceneName"] == scene_name
+                    and response["ok"]
+                ):
+                    scene_items = sorted(
+                        response["data"]["sceneItems"],
+                        key=lambda item: item["sceneItemIndex"],
+                    )
+                    return cls(scene_name, [item["sourceName"] for item in scene_items])
+        return cls(scene_name, fallback_sources)
+
+    @property
+    def top_source(self) -> str:
+        return self._source_names[self._order[-1]] if self._order else None
+
+    @property
+    def scene_items(self) -> list[dict]:
+        return [
+            {
+                "sceneItemId": scene_item_id,
+                "sceneItemIndex": index,
+                "sourceName": self._source_names[scene_item_id],
+            }
+            for index, scene_item_id in enumerate(self._order)
+        ]
+
+    def register_event_callback(self, callback, event: str = None):
+        pass
+
+    async def call(self, request: simpleobsws.Request, *args, **kwargs):
+        return self.handle(request)
+
+    async def call_batch(self, requests: list[simpleobsws.Request], *args, **kwargs):
+        return [self.handle(request) for request in requests]
+
+    def handle(self, request: simpleobsws.Request) -> simpleobsws.RequestResponse:
+        self.requests += 1
+        data = request.requestData or {}
+        response = simpleobsws.RequestResponse(request.requestType)
+        response.requestStatus.result = True
+        response.requestStatus.code = 100
+        if request.requestType == "GetSceneItemList":
+            if data.get("sceneName") != self._scene_name:
+                response.requestStatus.result = False
+                response.requestStatus.code = 600
+                response.requestStatus.comment = "No source was found"
+                return response
+            response.responseData = {"sceneItems": self.scene_items}
+        elif request.requestType == "SetSceneItemIndex":
+            self._order.remove(data["sceneItemId"])
+            self._order.insert(data["sceneItemIndex"], data["sceneItemId"])
+        elif request.requestType == "SetInputMute":
+            self.mutes[data["inputName"]] = data["inputMuted"]
+        elif request.requestType == "GetInputMute":
+            response.responseData = {
+                "inputMuted": self.mutes.get(data["inputName"], False)
+            }
+        elif request.requestType == "GetCurrentProgramScene":
+            response.responseData = {"currentProgramSceneName": self._scene_name}
+        else:
+            self._logger.debug(
+                "[REPLAY] Stand-in OBS ignored %s request", request.requestType
+            )
+        return response
+
+
+class StandInEyes:
+    """Stands in for eyes.EyeDriver, showing every eye state straight away."""
+
+    async def show(self, state: str) -> str:
+        return state
+
+    async def close(self):
+        pass
+
+
+def decisions(entries: list[dict]) -> list[str]:
+    return [entry["source"] for entry in entries if entry["k"] == "decision"]
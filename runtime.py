@@ -0,0 +1,83 @@
+"""
+Runtime profiles.
+
+dev keeps asyncio's debug mode on, which names every slow callback and
+never-awaited coroutine at the cost of slowing every callback down. prod turns
+debug mode off, hands log records to a background thread so a slow terminal or
+disk never stalls the event loop, optionally runs on uvloop, and leaves slow
+callback reports to metrics.EventLoopLagMonitor, which only speaks up when the
+loop was blocked for longer than slow_callback_seconds.
+"""
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import queue
+
+PROFILES = ("prod", "dev")
+
+
+class Runtime:
+    def __init__(
+        self,
+        profile: str,
+        use_uvloop: bool = False,
+        slow_callback_seconds: float = 0.1,
+        logger=logging.getLogger(),
+    ):
+        if profile not in PROFILES:
+            raise ValueError(
+                f"Unknown runtime profile {profile!r}, expected one of {PROFILES}"
+            )
+        self.profile = profile
+        self.slow_callback_seconds = slow_callback_seconds
+        self._use_uvloop = use_uvloop
+        self._logger = logger
+        self._listener: logging.handlers.QueueListener = None
+
+    @property
+    def debug(self) -> bool:
+        return self.profile == "dev"
+
+    def start_logging(self):
+        """
+        In prod, swap the root logger's handlers for a queue drained by a background
+        thread, so the event loop only pays for putting records on the queue.
+        """
+        if self.debug or self._listener is not None:
+            return
+        root = logging.getLogger()
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(
+            records, *root.handlers, respect_handler_level=True
+        )
+        root.handlers = [logging.handlers.QueueHandler(records)]
+        self._listener.start()
+        # Flush what's still queued on the way out, even after exit()
+        atexit.register(self.stop_logging)
+
+    def stop_logging(self):
+        if self._listener is None:
+            return
+        listener, self._listener = self._listener, None
+        listener.stop()
+        logging.getLogger().handlers = list(listener.handlers)
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        if self._use_uvloop:
+            try:
+                import uvloop
+
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            except ImportError:
+                self._logger.warning(
+                    "[RUNTIME] uvloop is enabled but not installed, using asyncio's event loop"
+                )
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_debug(enabled=self.debug)
+        loop.slow_callback_duration = self.slow_callback_seconds
+        self._logger.info(
+            f"[RUNTIME] {self.profile} profile on {type(loop).__module__}.{type(loop).__name__}"
+        )
+        return loop
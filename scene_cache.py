@@ -0,0 +1,147 @@
+"""
+In-process index of OBS scene items.
+
+The index for a scene is built with a single GetSceneItemList when it is first
+needed, then kept current from obs-websocket SceneItems and Inputs events, so
+looking up a source's position costs no websocket traffic.
+"""
+import logging
+
+import simpleobsws
+
+
+class SceneIndex:
+    def __init__(self, scene_items: list[dict]):
+        ordered = sorted(scene_items, key=lambda x: x["sceneItemIndex"])
+        self.order: list[int] = [item["sceneItemId"] for item in ordered]
+        self.ids_by_name: dict[str, int] = {
+            item["sourceName"]: item["sceneItemId"] for item in ordered
+        }
+        self._reindex()
+
+    def _reindex(self):
+        self.index_by_id: dict[int, int] = {
+            scene_item_id: index for index, scene_item_id in enumerate(self.order)
+        }
+        self.top_index: int = len(self.order) - 1
+
+    def insert(self, source_name: str, scene_item_id: int, index: int):
+        self.order.insert(index, scene_item_id)
+        self.ids_by_name[source_name] = scene_item_id
+        self._reindex()
+
+    def remove(self, scene_item_id: int):
+        if scene_item_id in self.index_by_id:
+            self.order.remove(scene_item_id)
+        self.ids_by_name = {
+            name: item_id
+            for name, item_id in self.ids_by_name.items()
+            if item_id != scene_item_id
+        }
+        self._reindex()
+
+    def move(self, scene_item_id: int, index: int):
+        self.order.remove(scene_item_id)
+        self.order.insert(index, scene_item_id)
+        self._reindex()
+
+    def set_order(self, scene_items: list[dict]):
+        ordered = sorted(scene_items, key=lambda x: x["sceneItemIndex"])
+        self.order = [item["sceneItemId"] for item in ordered]
+        self._reindex()
+
+    def rename(self, old_name: str, new_name: str):
+        if old_name in self.ids_by_name:
+            self.ids_by_name[new_name] = self.ids_by_name.pop(old_name)
+
+
+class SceneItemCache:
+    def __init__(self, ws: simpleobsws.WebSocketClient, logger=logging.getLogger()):
+        self._ws = ws
+        self._logger = logger
+        self._scenes: dict[str, SceneIndex] = {}
+
+    def register_event_callbacks(self):
+        self._ws.register_event_callback(self.on_scene_item_created, "SceneItemCreated")
+        self._ws.register_event_callback(self.on_scene_item_removed, "SceneItemRemoved")
+        self._ws.register_event_callback(
+            self.on_scene_item_list_reindexed, "SceneItemListReindexed"
+        )
+        self._ws.register_event_callback(self.on_input_name_changed, "InputNameChanged")
+        self._ws.register_event_callback(self.on_scene_changed, "SceneRemoved")
+        self._ws.register_event_callback(self.on_scene_changed, "SceneNameChanged")
+
+    async def refresh(self, scene_name: str) -> SceneIndex:
+        response = await self._ws.call(
+            simpleobsws.Request("GetSceneItemList", {"sceneName": scene_name})
+        )
+        if not response.ok():
+            self._logger.error(
+                f"[SCENE CACHE] Unable to list scene items for {scene_name}: {response.requestStatus.comment}"
+            )
+            self._scenes.pop(scene_name, None)
+            return None
+        scene_index = SceneIndex(response.responseData["sceneItems"])
+        self._scenes[scene_name] = scene_index
+        self._logger.debug(
+            "[SCENE CACHE] Indexed %d scene items in %s",
+            len(scene_index.order),
+            scene_name,
+        )
+        return scene_index
+
+    def invalidate(self, scene_name: str = None):
+        if scene_name is None:
+            self._scenes.clear()
+        else:
+            self._scenes.pop(scene_name, None)
+
+    async def lookup(self, scene_name: str, source_name: str):
+        """
+        Returns (sceneItemId, sceneItemIndex, top sceneItemIndex) for source_name,
+        or None if the scene doesn't contain it. Only talks to OBS if the scene
+        hasn't been indexed yet, or the source is missing from the index.
+        """
+        scene_index = self._scenes.get(scene_name)
+        if scene_index is None or source_name not in scene_index.ids_by_name:
+            scene_index = await self.refresh(scene_name)
+            if scene_index is None or source_name not in scene_index.ids_by_name:
+                return None
+        scene_item_id = scene_index.ids_by_name[source_name]
+        return (
+            scene_item_id,
+            scene_index.index_by_id[scene_item_id],
+            scene_index.top_index,
+        )
+
+    def moved(self, scene_name: str, scene_item_id: int, index: int):
+        """Apply a SetSceneItemIndex we sent ourselves without waiting for its event."""
+        scene_index = self._scenes.get(scene_name)
+        if scene_index is not None and scene_item_id in scene_index.index_by_id:
+            scene_index.move(scene_item_id, index)
+
+    async def on_scene_item_created(self, eventData):
+        scene_index = self._scenes.get(eventData["sceneName"])
+        if scene_index is not None:
+            scene_index.insert(
+                eventData["sourceName"],
+                eventData["sceneItemId"],
+                eventData["sceneItemIndex"],
+            )
+
+    async def on_scene_item_removed(self, eventData):
+        scene_index = self._scenes.get(eventData["sceneName"])
+        if scene_index is not None:
+            scene_index.remove(eventData["sceneItemId"])
+
+    async def on_scene_item_list_reindexed(self, eventData):
+        scene_index = self._scenes.get(eventData["sceneName"])
+        if scene_index is not None:
+            scene_index.set_order(eventData["sceneItems"])
+
+    async def on_input_name_changed(self, eventData):
+        for scene_index in self._scenes.values():
+            scene_index.rename(eventData["oldInputName"], eventData["inputName"])
+
+    async def on_scene_changed(self, eventData):
+        self.invalidate(eventData.get("oldSceneName", eventData.get("sceneName")))
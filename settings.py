@@ -0,0 +1,569 @@
+"""
+Compiled configuration.
+
+config.CONFIG stays a plain dictionary so it's easy to edit. compile_config()
+checks it once at startup, reporting every problem together instead of as a
+KeyError mid-run, and turns the selected event and environment into frozen,
+slotted settings with the lookup tables the switching path needs worked out in
+advance.
+"""
+import datetime
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from bid_clients import BID_CLIENTS
+from runtime import PROFILES
+
+
+class ConfigError(Exception):
+    """config.CONFIG is missing something, or has a value that can't work."""
+
+
+@dataclass(frozen=True, slots=True)
+class RuntimeSettings:
+    profile: str
+    uvloop: bool
+    slow_callback_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class MetricsSettings:
+    host: str
+    port: int
+    loop_lag_interval_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class ObsTargetSettings:
+    name: str
+    host: str
+    port: int
+    password: str
+    scene: str
+    mute_inputs: Mapping[str, str]
+    source_names: Mapping[str, str]
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+
+@dataclass(frozen=True, slots=True)
+class ObsSettings:
+    ws_update_interval_seconds: float
+    probe_timeout_seconds: float
+    max_reconnect_delay_seconds: float
+    sources: tuple[str, ...]
+    reverify_interval_seconds: float
+    targets: tuple[ObsTargetSettings, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class DisplaySettings:
+    width: int
+    height: int
+    pixel_order: str
+
+
+@dataclass(frozen=True, slots=True)
+class TasbotSettings:
+    python: str
+    aninja: str
+    draw_timeout_seconds: float
+    aninja_frame_function: str
+    frame_cache_dir: str
+    display: DisplaySettings
+    images: Mapping[str, str]
+
+
+@dataclass(frozen=True, slots=True)
+class TrackedBid:
+    bid_id: int
+    friendly_name: str
+    source: str
+
+
+@dataclass(frozen=True, slots=True)
+class AdaptivePollingSettings:
+    min_interval_seconds: float
+    max_interval_seconds: float
+    close_margin: float
+    comfortable_margin: float
+    max_error_backoff_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class DecisionSettings:
+    min_margin: float
+    dwell_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class HistorySettings:
+    capacity: int
+    rate_window_seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class EventSettings:
+    name: str
+    env: str
+    bid_client: str
+    bid_check_ttl: datetime.timedelta
+    api_base_url: str
+    batch_url: str
+    stream_url: str
+    bids_to_track: tuple[TrackedBid, ...]
+    poll_interval_seconds: float
+    adaptive_polling: AdaptivePollingSettings
+    decision: DecisionSettings
+    history: HistorySettings
+    bid_request_timeout_seconds: float
+    http_pool_size: int
+    http_keepalive_seconds: float
+    response_cache_ttl_seconds: float
+    # Worked out from bids_to_track
+    bid_ids: tuple[int, ...]
+    source_by_bid_id: Mapping[int, str]
+    friendly_name_by_bid_id: Mapping[int, str]
+    tie_source: str
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    ttl_persist_path: str
+    stats_interval_seconds: float
+    runtime: RuntimeSettings
+    metrics: MetricsSettings
+    obs: ObsSettings
+    tasbot: TasbotSettings
+    event: EventSettings
+
+
+NUMBER = (int, float)
+KIND_NAMES = {
+    bool: "True or False",
+    int: "a whole number",
+    float: "a number",
+    str: "a string",
+    list: "a list",
+    dict: "a dictionary",
+    datetime.timedelta: "a datetime.timedelta",
+}
+
+
+class _Reader:
+    """Reads values out of CONFIG, noting every problem instead of stopping at the first."""
+
+    def __init__(self):
+        self.errors: list[str] = []
+
+    def section(self, parent: dict, key: str, path: str) -> dict:
+        # A missing parent was already reported, don't repeat it for every child
+        if not parent:
+            return {}
+        value = parent.get(key)
+        if not isinstance(value, dict):
+            self.errors.append(
+                f"{path}.{key} is missing"
+                if value is None
+                else f"{path}.{key} should be a dictionary"
+            )
+            return {}
+        return value
+
+    def value(
+        self,
+        section: dict,
+        key: str,
+        path: str,
+        kinds: tuple,
+        optional: bool = False,
+        positive: bool = False,
+        non_negative: bool = False,
+    ):
+        if key not in section:
+            if section:
+                self.errors.append(f"{path}.{key} is missing")
+            return None
+        value = section[key]
+        if value is None:
+            if not optional:
+                self.errors.append(f"{path}.{key} must be set")
+            return None
+        # bool is an int, but True is never a sensible port or interval
+        if not isinstance(value, kinds) or (
+            isinstance(value, bool) and bool not in kinds
+        ):
+            kind = "a number" if kinds == NUMBER else KIND_NAMES[kinds[0]]
+            self.errors.append(f"{path}.{key} should be {kind}, not {value!r}")
+            return None
+        if positive and value <= 0:
+            self.errors.append(f"{path}.{key} should be positive, not {value!r}")
+        if non_negative and value < 0:
+            self.errors.append(f"{path}.{key} should be 0 or more, not {value!r}")
+        return value
+
+
+def _tracked_bids(reader: _Reader, bids: list, path: str) -> tuple[TrackedBid, ...]:
+    if not isinstance(bids, list) or not bids:
+        reader.errors.append(f"{path} should be a non-empty list")
+        return ()
+    tracked: list[TrackedBid] = []
+    for index, bid in enumerate(bids):
+        bid_path = f"{path}[{index}]"
+        if not isinstance(bid, dict):
+            reader.errors.append(f"{bid_path} should be a dictionary")
+            continue
+        tracked.append(
+            TrackedBid(
+                bid_id=reader.value(bid, "bid_id", bid_path, (int,), optional=True),
+                friendly_name=reader.value(bid, "friendly_name", bid_path, (str,)),
+                source=reader.value(bid, "source", bid_path, (str,)),
+            )
+        )
+    bid_ids = [bid.bid_id for bid in tracked if bid.bid_id is not None]
+    if len(set(bid_ids)) != len(bid_ids):
+        reader.errors.append(f"{path} tracks the same bid_id more than once")
+    if len(tracked) - len(bid_ids) > 1:
+        reader.errors.append(f"{path} has more than one tie (bid_id None) entry")
+    return tuple(tracked)
+
+
+def _decision_value(
+    reader: _Reader,
+    key: str,
+    decision: dict,
+    env_decision: dict,
+    event_path: str,
+    env_path: str,
+):
+    # A negative margin or dwell time would turn the hysteresis off, or invert it
+    if key in env_decision:
+        return reader.value(
+            env_decision, key, f"{env_path}.decision", NUMBER, non_negative=True
+        )
+    return reader.value(
+        decision, key, f"{event_path}.decision", NUMBER, non_negative=True
+    )
+
+
+def _obs_targets(
+    reader: _Reader, targets: dict, sources: list, path: str
+) -> tuple[ObsTargetSettings, ...]:
+    if targets is None:
+        return ()
+    if not targets:
+        reader.errors.append(f"{path} should have at least one target")
+        return ()
+    compiled: list[ObsTargetSettings] = []
+    for name, target in targets.items():
+        target_path = f"{path}.{name}"
+        if not isinstance(target, dict):
+            reader.errors.append(f"{target_path} should be a dictionary")
+            continue
+        mute_inputs = reader.value(target, "mute_inputs", target_path, (dict,)) or {}
+        source_names = (
+            reader.value(target, "source_names", target_path, (dict,), optional=True)
+            or {}
+        )
+        for key, mapping in (
+            ("mute_inputs", mute_inputs),
+            ("source_names", source_names),
+        ):
+            for source in mapping:
+                if source not in sources:
+                    reader.errors.append(
+                        f"{target_path}.{key} has {source!r}, which isn't in obs.sources"
+                    )
+        compiled.append(
+            ObsTargetSettings(
+                name=name,
+                host=reader.value(target, "host", target_path, (str,)),
+                port=reader.value(target, "port", target_path, (int,)),
+                password=reader.value(
+                    target, "password", target_path, (str,), optional=True
+                ),
+                scene=reader.value(target, "scene", target_path, (str,)),
+                mute_inputs=MappingProxyType(dict(mute_inputs)),
+                source_names=MappingProxyType(dict(source_names)),
+            )
+        )
+    return tuple(compiled)
+
+
+def compile_config(config: dict, event: str = None, env: str = None) -> Settings:
+    """
+    Check config and compile it for event and env (by default main.event and
+    main.env). Raises ConfigError listing everything that's wrong.
+    """
+    reader = _Reader()
+    main = reader.section(config, "main", "CONFIG")
+    event = event or reader.value(main, "event", "main", (str,))
+    env = env or reader.value(main, "env", "main", (str,))
+
+    runtime_config = reader.section(main, "runtime", "main")
+    runtime = RuntimeSettings(
+        profile=reader.value(runtime_config, "profile", "main.runtime", (str,)),
+        uvloop=reader.value(runtime_config, "uvloop", "main.runtime", (bool,)),
+        slow_callback_seconds=reader.value(
+            runtime_config,
+            "slow_callback_seconds",
+            "main.runtime",
+            NUMBER,
+            positive=True,
+        ),
+    )
+    if runtime.profile is not None and runtime.profile not in PROFILES:
+        reader.errors.append(
+            f"main.runtime.profile should be one of {PROFILES}, not {runtime.profile!r}"
+        )
+    metrics_config = reader.section(main, "metrics", "main")
+    metrics = MetricsSettings(
+        host=reader.value(metrics_config, "host", "main.metrics", (str,)),
+        port=reader.value(
+            metrics_config, "port", "main.metrics", (int,), optional=True
+        ),
+        loop_lag_interval_seconds=reader.value(
+            metrics_config,
+            "loop_lag_interval_seconds",
+            "main.metrics",
+            NUMBER,
+            positive=True,
+        ),
+    )
+
+    obs_config = reader.section(config, "obs", "CONFIG")
+    sources = reader.value(obs_config, "sources", "obs", (list,)) or []
+    obs = ObsSettings(
+        ws_update_interval_seconds=reader.value(
+            obs_config, "ws_update_interval_seconds", "obs", NUMBER, positive=True
+        ),
+        probe_timeout_seconds=reader.value(
+            obs_config, "probe_timeout_seconds", "obs", NUMBER, positive=True
+        ),
+        max_reconnect_delay_seconds=reader.value(
+            obs_config, "max_reconnect_delay_seconds", "obs", NUMBER, positive=True
+        ),
+        sources=tuple(sources),
+        reverify_interval_seconds=reader.value(
+            obs_config, "reverify_interval_seconds", "obs", NUMBER, positive=True
+        ),
+        targets=_obs_targets(
+            reader,
+            reader.value(obs_config, "targets", "obs", (dict,)),
+            sources,
+            "obs.targets",
+        ),
+    )
+
+    tasbot_config = reader.section(config, "tasbot", "CONFIG")
+    display_config = reader.section(tasbot_config, "display", "tasbot")
+    images = reader.value(tasbot_config, "images", "tasbot", (dict,)) or {}
+    tasbot = TasbotSettings(
+        python=reader.value(tasbot_config, "python", "tasbot", (str,)),
+        aninja=reader.value(tasbot_config, "aninja", "tasbot", (str,)),
+        draw_timeout_seconds=reader.value(
+            tasbot_config, "draw_timeout_seconds", "tasbot", NUMBER, positive=True
+        ),
+        aninja_frame_function=reader.value(
+            tasbot_config, "aninja_frame_function", "tasbot", (str,), optional=True
+        ),
+        frame_cache_dir=reader.value(
+            tasbot_config, "frame_cache_dir", "tasbot", (str,)
+        ),
+        display=DisplaySettings(
+            width=reader.value(
+                display_config, "width", "tasbot.display", (int,), positive=True
+            ),
+            height=reader.value(
+                display_config, "height", "tasbot.display", (int,), positive=True
+            ),
+            pixel_order=reader.value(
+                display_config, "pixel_order", "tasbot.display", (str,)
+            ),
+        ),
+        images=MappingProxyType(dict(images)),
+    )
+
+    events = reader.section(config, "events", "CONFIG")
+    event_config = reader.section(events, event, "events") if event else {}
+    event_path = f"events.{event}"
+    env_config = reader.section(event_config, env, event_path) if env else {}
+    env_path = f"{event_path}.{env}"
+    bids_to_track = (
+        _tracked_bids(
+            reader, env_config.get("bids_to_track"), f"{env_path}.bids_to_track"
+        )
+        if env_config
+        else ()
+    )
+    for bid in bids_to_track:
+        if bid.source is None:
+            continue
+        if bid.source not in sources:
+            reader.errors.append(
+                f"{env_path}.bids_to_track has source {bid.source!r}, which isn't in obs.sources"
+            )
+        if images and bid.source.lower() not in images:
+            reader.errors.append(
+                f"tasbot.images has no {bid.source.lower()!r} image for source {bid.source!r}"
+            )
+    adaptive_config = reader.section(event_config, "adaptive_polling", event_path)
+    adaptive_path = f"{event_path}.adaptive_polling"
+    decision_config = reader.section(event_config, "decision", event_path)
+    # An environment can override the event's decision settings, e.g. the mock
+    # tracker's lead changes are only $1
+    env_decision_config = (
+        reader.section(env_config, "decision", env_path)
+        if "decision" in env_config
+        else {}
+    )
+    history_config = reader.section(event_config, "history", event_path)
+    tracked_bids = [bid for bid in bids_to_track if bid.bid_id is not None]
+    tie_bids = [bid for bid in bids_to_track if bid.bid_id is None]
+    # An environment can use a different tracker, e.g. the mock tracker
+    bid_client = (
+        reader.value(env_config, "bid_client", env_path, (str,))
+        if "bid_client" in env_config
+        else reader.value(event_config, "bid_client", event_path, (str,))
+    )
+    if bid_client is not None and bid_client not in BID_CLIENTS:
+        reader.errors.append(
+            f"bid_client should be one of {tuple(BID_CLIENTS)}, not {bid_client!r}"
+        )
+    event_settings = EventSettings(
+        name=event,
+        env=env,
+        bid_client=bid_client,
+        bid_check_ttl=reader.value(
+            event_config, "bid_check_ttl", event_path, (datetime.timedelta,)
+        ),
+        api_base_url=reader.value(env_config, "api_base_url", env_path, (str,)),
+        batch_url=reader.value(
+            env_config, "batch_url", env_path, (str,), optional=True
+        ),
+        stream_url=reader.value(
+            env_config, "stream_url", env_path, (str,), optional=True
+        ),
+        bids_to_track=bids_to_track,
+        poll_interval_seconds=reader.value(
+            event_config, "poll_interval_seconds", event_path, NUMBER, positive=True
+        ),
+        adaptive_polling=(
+            AdaptivePollingSettings(
+                min_interval_seconds=reader.value(
+                    adaptive_config,
+                    "min_interval_seconds",
+                    adaptive_path,
+                    NUMBER,
+                    positive=True,
+                ),
+                max_interval_seconds=reader.value(
+                    adaptive_config,
+                    "max_interval_seconds",
+                    adaptive_path,
+                    NUMBER,
+                    positive=True,
+                ),
+                close_margin=reader.value(
+                    adaptive_config, "close_margin", adaptive_path, NUMBER
+                ),
+                comfortable_margin=reader.value(
+                    adaptive_config, "comfortable_margin", adaptive_path, NUMBER
+                ),
+                max_error_backoff_seconds=reader.value(
+                    adaptive_config,
+                    "max_error_backoff_seconds",
+                    adaptive_path,
+                    NUMBER,
+                    positive=True,
+                ),
+            )
+            if reader.value(adaptive_config, "enabled", adaptive_path, (bool,))
+            else None
+        ),
+        decision=DecisionSettings(
+            min_margin=_decision_value(
+                reader,
+                "min_margin",
+                decision_config,
+                env_decision_config,
+                event_path,
+                env_path,
+            ),
+            dwell_seconds=_decision_value(
+                reader,
+                "dwell_seconds",
+                decision_config,
+                env_decision_config,
+                event_path,
+                env_path,
+            ),
+        ),
+        history=HistorySettings(
+            capacity=reader.value(
+                history_config,
+                "capacity",
+                f"{event_path}.history",
+                (int,),
+                positive=True,
+            ),
+            rate_window_seconds=reader.value(
+                history_config,
+                "rate_window_seconds",
+                f"{event_path}.history",
+                NUMBER,
+                positive=True,
+            ),
+        ),
+        bid_request_timeout_seconds=reader.value(
+            event_config,
+            "bid_request_timeout_seconds",
+            event_path,
+            NUMBER,
+            positive=True,
+        ),
+        http_pool_size=reader.value(
+            event_config, "http_pool_size", event_path, (int,), positive=True
+        ),
+        http_keepalive_seconds=reader.value(
+            event_config, "http_keepalive_seconds", event_path, NUMBER, positive=True
+        ),
+        response_cache_ttl_seconds=reader.value(
+            event_config,
+            "response_cache_ttl_seconds",
+            event_path,
+            NUMBER,
+            optional=True,
+        ),
+        bid_ids=tuple(bid.bid_id for bid in tracked_bids),
+        source_by_bid_id=MappingProxyType(
+            {bid.bid_id: bid.source for bid in tracked_bids}
+        ),
+        friendly_name_by_bid_id=MappingProxyType(
+            {bid.bid_id: bid.friendly_name for bid in tracked_bids}
+        ),
+        tie_source=tie_bids[0].source if tie_bids else None,
+    )
+
+    settings = Settings(
+        ttl_persist_path=reader.value(
+            main, "ttl_persist_path", "main", (str,), optional=True
+        ),
+        stats_interval_seconds=reader.value(
+            main, "stats_interval_seconds", "main", NUMBER, positive=True
+        ),
+        runtime=runtime,
+        metrics=metrics,
+        obs=obs,
+        tasbot=tasbot,
+        event=event_settings,
+    )
+    if reader.errors:
+        raise ConfigError(
+            "Invalid configuration in config.py:\n"
+            + "\n".join(f"  - {error}" for error in reader.errors)
+        )
+    return settings
@@ -0,0 +1,89 @@
+"""
+Warm restart snapshots.
+
+What the switcher would otherwise have to rediscover after a crash or restart
+(when the run started, whether its TTL already ran out, the last bid totals, what
+is on air and which eyes TASBot is showing) is kept in a small JSON snapshot.
+Snapshots are written behind the switching path: update() only hands over the
+latest state, and a background task writes it to a temporary file in a worker
+thread and renames it over the snapshot, so a crash mid-write always leaves the
+previous snapshot intact. Nothing is written while the state stays the same.
+"""
+import asyncio
+import json
+import logging
+import os
+
+
+def load_snapshot(path: str, logger=logging.getLogger()) -> dict:
+    """The saved snapshot, or None if there isn't a usable one."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"[SNAPSHOT] Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+
+def write_snapshot(path: str, state: dict):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class SnapshotWriter:
+    def __init__(self, path: str, logger=logging.getLogger()):
+        self._path = path
+        self._logger = logger
+        self._written: dict = None
+        self._pending: dict = None
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._closed: bool = False
+        self.writes: int = 0
+
+    def start(self, written: dict = None):
+        """written is the snapshot already on disk, if any, so it isn't rewritten."""
+        self._written = written
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def update(self, state: dict):
+        if state == (self._pending or self._written):
+            return
+        self._pending = state
+        self._changed.set()
+
+    async def _run(self):
+        while not self._closed:
+            await self._changed.wait()
+            await self._flush()
+        await self._flush()
+
+    async def _flush(self):
+        self._changed.clear()
+        state, self._pending = self._pending, None
+        if state is None or state == self._written:
+            return
+        try:
+            await asyncio.to_thread(write_snapshot, self._path, state)
+        except OSError as e:
+            self._logger.error(f"[SNAPSHOT] Unable to write {self._path}: {e}")
+            return
+        self._written = state
+        self.writes += 1
+
+    async def close(self):
+        """Write whatever is still pending, then stop."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Let a write that's already running finish rather than racing it
+        self._closed = True
+        self._changed.set()
+        await task
@@ -0,0 +1,125 @@
+"""
+Push-based bid ingestion.
+
+Subscribes to a Server-Sent Events feed of bid totals and hands every update to a
+callback the moment it arrives, instead of waiting for the next poll. Each event's
+data is a tracker bid search response ({"count": ..., "results": [...]}),
+optionally with a "published_at" unix timestamp for measuring delivery latency.
+
+While the stream is down, `connected` is False so the poller can take over, and
+the stream reconnects with backoff in the background.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+
+from bid_clients import BidClient
+from metrics import RECONNECTS, TRACKER_ERRORS
+from tracker import BidLookupError
+
+
+class BidStream:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        bid_client: BidClient,
+        on_update,
+        read_timeout_seconds: float = 30.0,
+        max_reconnect_delay_seconds: float = 30.0,
+        logger=logging.getLogger(),
+    ):
+        """
+        on_update is an async callable taking a dict of bid_id -> bid_clients.Bid for
+        the tracked bids included in each event, as picked out by bid_client.
+        """
+        self._session = session
+        self._url = url
+        self._bid_client = bid_client
+        self._on_update = on_update
+        self._read_timeout_seconds = read_timeout_seconds
+        self._max_reconnect_delay_seconds = max_reconnect_delay_seconds
+        self._logger = logger
+        self._task: asyncio.Task = None
+        self.connected: bool = False
+        self.events: int = 0
+        self.reconnects: int = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.connected = False
+
+    async def _run(self):
+        reconnect_delay = 0.5
+        while True:
+            try:
+                await self._consume()
+                self._logger.warning("[STREAM] Bid stream closed by the tracker")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                TRACKER_ERRORS.inc("stream")
+                self._logger.error(f"[STREAM] Bid stream error: {e!r}")
+            if self.connected:
+                reconnect_delay = 0.5
+            self.connected = False
+            self._logger.info(
+                f"[STREAM] Falling back to polling, reconnecting in {reconnect_delay}s"
+            )
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(
+                reconnect_delay * 2, self._max_reconnect_delay_seconds
+            )
+            self.reconnects += 1
+            RECONNECTS.inc("tracker_stream")
+
+    async def _consume(self):
+        async with self._session.get(
+            self._url,
+            headers={"Accept": "text/event-stream"},
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=5, sock_read=self._read_timeout_seconds
+            ),
+        ) as resp:
+            resp.raise_for_status()
+            self.connected = True
+            self._logger.info(f"[STREAM] Subscribed to {self._url}")
+            data_lines: list[str] = []
+            async for raw_line in resp.content:
+                line = raw_line.decode().rstrip("\r\n")
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+                elif not line and data_lines:
+                    await self._dispatch("\n".join(data_lines))
+                    data_lines = []
+
+    async def _dispatch(self, data: str):
+        self.events += 1
+        payload = json.loads(data)
+        if "published_at" in payload:
+            self._logger.debug(
+                "[STREAM] Update delivered in %.1fms",
+                (time.time() - payload["published_at"]) * 1000,
+            )
+        try:
+            bids = self._bid_client.bids_from_response(
+                payload, self._url, require_all=False
+            )
+        except BidLookupError as e:
+            self._logger.error(e)
+            return
+        if not bids:
+            return
+        try:
+            await self._on_update(bids)
+        except Exception:
+            self._logger.exception("[STREAM] Error handling bid update")
@@ -0,0 +1,226 @@
+"""
+OBS targets.
+
+Every configured OBS instance (say the main encoder, a backup encoder and a venue
+screen) is an ObsTarget with its own connection, supervisor, scene item cache and
+reconciler. ObsTargets fans each switch out to all of them at once, and every
+target applies it in its own task, so a slow or unreachable instance only ever
+delays itself. A target that falls behind skips straight to the latest switch.
+"""
+import asyncio
+import logging
+import time
+
+import simpleobsws
+
+from metrics import DECISION_TO_AIR_SECONDS, TimedWebSocketClient
+from obs_supervisor import ObsSupervisor
+from recording import Recorder, RecordingWebSocketClient
+from reconciler import Reconciler
+from scene_cache import SceneItemCache
+
+
+class ObsTarget:
+    def __init__(
+        self,
+        name: str,
+        ws: simpleobsws.WebSocketClient,
+        scene_name: str,
+        mute_inputs: dict[str, str],
+        source_names: dict[str, str] = None,
+        on_live=None,
+        active=None,
+        recorder: Recorder = None,
+        logger=logging.getLogger(),
+    ):
+        """
+        on_live is an async callable run whenever scene_name is found on the
+        program output. active is a callable saying whether the switcher is in
+        charge of what's on air; while it isn't, reconnecting only re-reads OBS.
+        """
+        self.name = name
+        self.scene_name = scene_name
+        self._ws = ws
+        client = (
+            ws if recorder is None else RecordingWebSocketClient(ws, recorder, name)
+        )
+        self.client = TimedWebSocketClient(client, name)
+        self.scene_item_cache = SceneItemCache(self.client, logger)
+        self.reconciler = Reconciler(
+            name,
+            self.client,
+            self.scene_item_cache,
+            scene_name,
+            mute_inputs,
+            source_names,
+            logger,
+        )
+        self._on_live = on_live
+        self._active = active
+        self._logger = logger
+        self.supervisor: ObsSupervisor = None
+        self._switch_task: asyncio.Task = None
+        self._reverify_task: asyncio.Task = None
+        # When the change behind the switch still being applied was detected
+        self._detected_at: float = None
+        self._switches: int = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.supervisor is None or self.supervisor.connected
+
+    @property
+    def busy(self) -> bool:
+        return self._switch_task is not None and not self._switch_task.done()
+
+    def register_event_callbacks(self):
+        # Callbacks stay registered on the client across reconnects
+        self._ws.register_event_callback(
+            self.on_program_scene_changed, "CurrentProgramSceneChanged"
+        )
+        self.scene_item_cache.register_event_callbacks()
+        self.reconciler.register_event_callbacks()
+
+    def supervise(
+        self,
+        probe_interval_seconds: float,
+        probe_timeout_seconds: float,
+        max_reconnect_delay_seconds: float,
+    ):
+        """
+        Connect in the background and stay connected. Without this, e.g. against a
+        stand-in, the target counts as always connected.
+        """
+        self.supervisor = ObsSupervisor(
+            self.name,
+            self._ws,
+            self._on_connected,
+            probe_interval_seconds=probe_interval_seconds,
+            probe_timeout_seconds=probe_timeout_seconds,
+            max_reconnect_delay_seconds=max_reconnect_delay_seconds,
+            logger=self._logger,
+        )
+        self.supervisor.start()
+
+    def switch(self, source: str, detected_at: float = None):
+        """Put source on air in the background and return straight away."""
+        desired = self.reconciler.state_for(source)
+        if self.reconciler.desired == desired:
+            return
+        self.reconciler.desired = desired
+        self._detected_at = detected_at
+        self._switches += 1
+        if not self.connected:
+            # Only the latest switch matters, it's applied once OBS is back
+            self._logger.warning(
+                f"[SWITCHER] {self.name}: OBS is unreachable, holding {source}"
+            )
+            return
+        if not self.busy:
+            self._switch_task = asyncio.create_task(self._apply())
+
+    async def _apply(self):
+        try:
+            # A switch made while this one was being applied is picked up right after
+            while True:
+                switches = self._switches
+                await self.reconciler.reconcile()
+                self._on_air()
+                if self._switches == switches:
+                    return
+        except Exception as e:
+            self._logger.error(f"[SWITCHER] {self.name}: Unable to switch: {e!r}")
+
+    def _on_air(self):
+        if self._detected_at is not None:
+            DECISION_TO_AIR_SECONDS.observe(
+                time.monotonic() - self._detected_at, self.name
+            )
+            self._detected_at = None
+
+    def reverify(self):
+        """
+        Re-read and correct what's on air in the background, unless that's still
+        running from last time.
+        """
+        if not self.connected or self.reconciler.desired is None:
+            return
+        if self._reverify_task is None or self._reverify_task.done():
+            self._reverify_task = asyncio.create_task(self._reverify())
+
+    async def _reverify(self):
+        try:
+            await self.reconciler.reverify()
+        except Exception as e:
+            self._logger.error(
+                f"[SWITCHER] {self.name}: Unable to verify what's on air: {e!r}"
+            )
+
+    async def is_live(self) -> bool:
+        response = await self.client.call(simpleobsws.Request("GetCurrentProgramScene"))
+        return (
+            response.ok()
+            and response.responseData["currentProgramSceneName"] == self.scene_name
+        )
+
+    async def _on_connected(self):
+        # OBS may have restarted, so nothing we knew about its scene items or mutes holds
+        apply = self._active is None or self._active()
+        await self.reconciler.resync(apply)
+        if apply:
+            self._on_air()
+        if self._on_live is not None and await self.is_live():
+            await self._on_live()
+
+    async def on_program_scene_changed(self, eventData):
+        if eventData["sceneName"] == self.scene_name and self._on_live is not None:
+            await self._on_live()
+
+    async def close(self):
+        for task in (self._switch_task, self._reverify_task):
+            if task is not None:
+                task.cancel()
+        if self.supervisor is not None:
+            await self.supervisor.close()
+
+
+class ObsTargets:
+    def __init__(self, targets: list[ObsTarget]):
+        self.targets: tuple[ObsTarget, ...] = tuple(targets)
+        # The source most recently switched to, whether or not it's on air everywhere
+        self.source: str = None
+
+    @property
+    def busy(self) -> bool:
+        return any(target.busy for target in self.targets)
+
+    def switch(self, source: str, detected_at: float = None):
+        self.source = source
+        for target in self.targets:
+            target.switch(source, detected_at)
+
+    def restore(self, source: str):
+        """
+        Take source as already on air, e.g. after a restart, without switching.
+        Each target puts it back on air when it connects if it isn't.
+        """
+        self.source = source
+        for target in self.targets:
+            target.reconciler.desired = target.reconciler.state_for(source)
+
+    def reverify(self):
+        for target in self.targets:
+            target.reverify()
+
+    async def any_live(self) -> bool:
+        """Whether any connected target has its scene on the program output."""
+        results = await asyncio.gather(
+            *(target.is_live() for target in self.targets if target.connected),
+            return_exceptions=True,
+        )
+        return any(result is True for result in results)
+
+    async def close(self):
+        await asyncio.gather(
+            *(target.close() for target in self.targets), return_exceptions=True
+        )
@@ -1,27 +1,136 @@
 import asyncio
+import logging
+import math
+
+from metrics import (
+    TIMER_ERRORS,
+    TIMER_LAG_SECONDS,
+    TIMER_OVERRUNS,
+    TIMER_SKIPPED_TICKS,
+)
 
 
 class Timer:
-    def __init__(self, interval, first_immediately, timer_name, context, callback):
+    """
+    Fixed-rate timer on the event loop's monotonic clock.
+
+    Ticks land on a grid of `interval` from the first tick, so the period doesn't
+    drift by however long the callback takes. If a callback overruns one or more
+    ticks, the missed ticks are skipped rather than fired back to back. Exceptions
+    from the callback are logged and retried with exponential backoff, so the timer
+    never silently stops.
+    """
+
+    def __init__(
+        self,
+        interval,
+        first_immediately,
+        timer_name,
+        context,
+        callback,
+        max_backoff_seconds=30.0,
+        logger=logging.getLogger(),
+    ):
         self._interval = interval
         self._first_immediately = first_immediately
         self._name = timer_name
         self._context = context
         self._callback = callback
-        self._is_first_call = True
+        self._max_backoff_seconds = max_backoff_seconds
+        self._logger = logger
         self._ok = True
+        self._next_tick: float = None
+
+        self.ticks: int = 0
+        self.overruns: int = 0
+        self.skipped_ticks: int = 0
+        self.errors: int = 0
+        self.consecutive_errors: int = 0
+        self.last_lag: float = 0.0
+        self.max_lag: float = 0.0
+        self.last_duration: float = 0.0
+
         self._task = asyncio.ensure_future(self._job())
-        print(timer_name + " init done")
+        self._logger.info(f"{timer_name} init done")
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    def set_interval(self, interval: float):
+        """Change the period. A shorter period takes effect from the next tick."""
+        if interval == self._interval:
+            return
+        self._interval = interval
+        if self._next_tick is not None:
+            self._next_tick = min(
+                self._next_tick, asyncio.get_running_loop().time() + interval
+            )
+
+    def stats(self) -> dict:
+        return {
+            "interval": self._interval,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped_ticks,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "last_duration": self.last_duration,
+        }
 
     async def _job(self):
-        try:
-            while self._ok:
-                if not self._is_first_call or not self._first_immediately:
-                    await asyncio.sleep(self._interval)
+        loop = asyncio.get_running_loop()
+        self._next_tick = loop.time()
+        if not self._first_immediately:
+            self._next_tick += self._interval
+        while self._ok:
+            delay = self._next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = loop.time()
+            self.last_lag = max(started - self._next_tick, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            TIMER_LAG_SECONDS.observe(self.last_lag, self._name)
+            try:
                 await self._callback(self._name, self._context, self)
-                self._is_first_call = False
-        except Exception as ex:
-            print(ex)
+            except Exception:
+                self.errors += 1
+                self.consecutive_errors += 1
+                TIMER_ERRORS.inc(self._name)
+                backoff = min(
+                    self._interval * 2 ** (self.consecutive_errors - 1),
+                    self._max_backoff_seconds,
+                )
+                self._logger.exception(
+                    f"[TIMER] {self._name} callback failed ({self.consecutive_errors} in a row), retrying in {backoff:.2f}s"
+                )
+                self._next_tick = loop.time() + backoff
+                continue
+            finished = loop.time()
+            self.ticks += 1
+            self.consecutive_errors = 0
+            self.last_duration = finished - started
+
+            self._next_tick += self._interval
+            if finished > self._next_tick:
+                missed = math.floor((finished - self._next_tick) / self._interval) + 1
+                self.overruns += 1
+                self.skipped_ticks += missed
+                TIMER_OVERRUNS.inc(self._name)
+                TIMER_SKIPPED_TICKS.inc(self._name, amount=missed)
+                self._next_tick += missed * self._interval
+                self._logger.debug(
+                    "[TIMER] %s overran by %d tick(s) (%.3fs)",
+                    self._name,
+                    missed,
+                    self.last_duration,
+                )
 
     def cancel(self):
         self._ok = False
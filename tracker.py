@@ -0,0 +1,126 @@
+"""
+HTTP helpers for talking to the bid tracker.
+
+The autoswitcher keeps one long-lived aiohttp.ClientSession for its whole
+lifetime so every poll reuses pooled, keep-alive connections instead of paying
+TCP/TLS setup again each tick. What the tracker's responses look like is up to
+the bid clients in bid_clients.py.
+"""
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+
+class BidLookupError(Exception):
+    """The tracker answered, but not with the single open bid we asked for."""
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    data: object
+    etag: str = None
+    last_modified: str = None
+    fetched_at: float = 0.0
+
+
+class ResponseCache:
+    """
+    The last decoded tracker response per URL, along with its validators.
+
+    Entries are only trusted for ttl_seconds after they were last decoded, after
+    which the next poll does an unconditional fetch and the result is treated as
+    changed again.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self._ttl_seconds = ttl_seconds
+        self._entries: dict[str, CachedResponse] = {}
+
+    def get(self, url: str) -> CachedResponse:
+        entry = self._entries.get(url)
+        if (
+            entry is not None
+            and time.monotonic() - entry.fetched_at > self._ttl_seconds
+        ):
+            del self._entries[url]
+            return None
+        return entry
+
+    def put(self, url: str, entry: CachedResponse):
+        entry.fetched_at = time.monotonic()
+        self._entries[url] = entry
+
+    def clear(self):
+        self._entries.clear()
+
+
+def create_tracker_session(
+    pool_size: int = 8, keepalive_timeout_seconds: float = 30.0
+) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        keepalive_timeout=keepalive_timeout_seconds,
+        ttl_dns_cache=300,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def get_decoded(
+    session: aiohttp.ClientSession,
+    url: str,
+    timeout_seconds: float,
+    decode,
+    cache: ResponseCache = None,
+    content_type: str = None,
+):
+    """
+    GET url and decode the body with decode. Returns (data, changed).
+
+    With a cache, the request is made conditional on the cached validators, and a
+    304 or a byte-identical body returns the cached data without decoding it again.
+    With a content_type, any other Content-Type (e.g. an HTML error page from a
+    proxy) raises aiohttp.ContentTypeError instead of being decoded.
+    """
+    cached = cache.get(url) if cache is not None else None
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    async with session.get(
+        url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout_seconds)
+    ) as resp:
+        if resp.status == 304 and cached is not None:
+            return cached.data, False
+        if resp.status != 200:
+            raise aiohttp.ClientResponseError(
+                resp.request_info,
+                resp.history,
+                status=resp.status,
+                message=resp.reason,
+            )
+        if content_type is not None and resp.content_type != content_type:
+            raise aiohttp.ContentTypeError(
+                resp.request_info,
+                resp.history,
+                status=resp.status,
+                message=f"Expected {content_type}, got {resp.content_type}",
+            )
+        body = await resp.read()
+        if cached is not None and body == cached.body:
+            return cached.data, False
+        data = decode(body)
+        if cache is not None:
+            cache.put(
+                url,
+                CachedResponse(
+                    body=body,
+                    data=data,
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                ),
+            )
+        return data, True
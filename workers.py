@@ -1,6 +1,118 @@
-async def consumer(event, data):
-    while True:
-        await event.wait()
-        event.clear()
-        if not data:
-            break
+"""
+Producer/consumer pipeline between bid ingestion and switching.
+
+Producers (the tracker poller and the bid stream) publish the latest tracker bid
+objects into a LatestValueChannel and move straight on. A single consumer wakes
+whenever something changed and runs the decision/switch step on it, so a slow OBS
+call never delays the next fetch and a slow fetch never delays a switch.
+"""
+import asyncio
+import logging
+import time
+
+
+class LatestValueChannel:
+    """
+    Bounded, latest-value-wins channel keyed by bid ID.
+
+    Publishing a bid that the consumer hasn't picked up yet replaces the old value
+    (counted as overwritten, i.e. backpressure) instead of queueing behind it.
+    """
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._values: dict = {}
+        self._oldest_published_at: float = None
+        self._changed = asyncio.Event()
+        self.published: dict[str, int] = {}
+        self.overwritten: dict[str, int] = {}
+        self.dropped: int = 0
+        self.max_depth: int = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._values)
+
+    def publish(self, key, value, source: str):
+        if key in self._values:
+            self.overwritten[source] = self.overwritten.get(source, 0) + 1
+        elif len(self._values) >= self._maxsize:
+            del self._values[next(iter(self._values))]
+            self.dropped += 1
+        if self._oldest_published_at is None:
+            self._oldest_published_at = time.monotonic()
+        self._values[key] = value
+        self.published[source] = self.published.get(source, 0) + 1
+        self.max_depth = max(self.max_depth, len(self._values))
+        self._changed.set()
+
+    async def get(self) -> tuple[dict, float]:
+        """
+        Wait for changes, then take everything published since the last call.
+        Returns (values, seconds the oldest of them waited in the channel).
+        """
+        await self._changed.wait()
+        self._changed.clear()
+        values, self._values = self._values, {}
+        waited = time.monotonic() - self._oldest_published_at
+        self._oldest_published_at = None
+        return values, waited
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "published": dict(self.published),
+            "overwritten": dict(self.overwritten),
+            "dropped": self.dropped,
+        }
+
+
+class Consumer:
+    def __init__(self, channel: LatestValueChannel, handle, logger=logging.getLogger()):
+        """handle is an async callable taking a dict of the values that changed."""
+        self._channel = channel
+        self._handle = handle
+        self._logger = logger
+        self._task: asyncio.Task = None
+        self.batches: int = 0
+        self.errors: int = 0
+        self.last_wait: float = 0.0
+        self.max_wait: float = 0.0
+        self.busy_seconds: float = 0.0
+        self.busy: bool = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            values, waited = await self._channel.get()
+            self.last_wait = waited
+            self.max_wait = max(self.max_wait, waited)
+            started = time.monotonic()
+            self.busy = True
+            try:
+                await self._handle(values)
+            except Exception:
+                self.errors += 1
+                self._logger.exception("[CONSUMER] Error handling bid update")
+            finally:
+                self.busy = False
+            self.busy_seconds += time.monotonic() - started
+            self.batches += 1
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_wait": self.last_wait,
+            "max_wait": self.max_wait,
+            "busy_seconds": self.busy_seconds,
+        }